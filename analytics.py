@@ -0,0 +1,237 @@
+"""
+会议统计：任务 COMPLETED 时解析一次 transcripts / chapters，结果写入 MeetingStats / SpeakerStats / KeywordStats
+仪表盘的跨会议聚合只查这些小表
+
+    python analytics.py --backfill   # 为已有的 COMPLETED 任务补算
+"""
+import json
+import logging
+import argparse
+import unicodedata
+from datetime import datetime
+from typing import Optional
+
+import numpy as np
+from sqlalchemy import delete, func
+from sqlmodel import Session, select
+
+from databacy import engine, Task, TaskCRUD, MeetingStats, SpeakerStats, KeywordStats
+
+logger = logging.getLogger(__name__)
+
+KEYWORD_LIMIT = 50       # 每个会议保留的高频词数量
+MIN_KEYWORD_LENGTH = 2   # 过滤单字 (的/了/是 ...)
+
+_failed = set()  # 本进程内计算失败的任务，补算时跳过，避免坏数据堵住队列
+
+
+def _extract_words(transcripts: dict):
+    """把听悟 Paragraphs -> Words 展平成按词的数组，后续计算全部向量化"""
+    paragraphs = (transcripts.get("Transcription") or {}).get("Paragraphs") or []
+    speakers, sentence_ids, starts, ends, texts = [], [], [], [], []
+    for paragraph in paragraphs:
+        speaker = str(paragraph.get("SpeakerId", ""))
+        paragraph_id = paragraph.get("ParagraphId", 0)
+        for word in paragraph.get("Words") or []:
+            speakers.append(speaker)
+            sentence_ids.append(str(word.get("SentenceId", paragraph_id)))
+            starts.append(word.get("Start", 0))
+            ends.append(word.get("End", 0))
+            texts.append(word.get("Text", ""))
+    return (
+        np.asarray(speakers, dtype=str),
+        np.asarray(sentence_ids, dtype=str),
+        np.asarray(starts, dtype=np.int64),
+        np.asarray(ends, dtype=np.int64),
+        np.asarray(texts, dtype=str),
+    )
+
+
+def _is_keyword(token: str) -> bool:
+    token = token.strip()
+    if len(token) < MIN_KEYWORD_LENGTH:
+        return False
+    return not all(unicodedata.category(ch)[0] in "PZS" for ch in token)
+
+
+def compute_stats(transcripts: dict, chapters: dict):
+    """
+    返回 (meeting, speakers, keywords)
+    meeting: MeetingStats 的字段 dict；speakers: [SpeakerStats 字段]；keywords: [(词, 次数)]
+    """
+    speakers, sentence_ids, starts, ends, texts = _extract_words(transcripts)
+
+    meeting = {"word_count": int(texts.size)}
+    speaker_rows = []
+    keywords = []
+
+    if texts.size:
+        speaker_names, speaker_idx = np.unique(speakers, return_inverse=True)
+
+        # 句子 = 同一个 SentenceId 的词；起止取组内最小/最大
+        _, sentence_idx = np.unique(sentence_ids, return_inverse=True)
+        n_sentences = int(sentence_idx.max()) + 1
+        sentence_start = np.full(n_sentences, np.iinfo(np.int64).max, dtype=np.int64)
+        sentence_end = np.zeros(n_sentences, dtype=np.int64)
+        np.minimum.at(sentence_start, sentence_idx, starts)
+        np.maximum.at(sentence_end, sentence_idx, ends)
+        sentence_speaker = np.empty(n_sentences, dtype=np.int64)
+        sentence_speaker[sentence_idx] = speaker_idx
+        sentence_ms = np.clip(sentence_end - sentence_start, 0, None)
+
+        n_speakers = speaker_names.size
+        talk_ms = np.bincount(sentence_speaker, weights=sentence_ms, minlength=n_speakers)
+        words_per_speaker = np.bincount(speaker_idx, minlength=n_speakers)
+        sentences_per_speaker = np.bincount(sentence_speaker, minlength=n_speakers)
+
+        speaker_rows = [
+            {
+                "speaker_id": str(speaker_names[i]),
+                "talk_ms": int(talk_ms[i]),
+                "word_count": int(words_per_speaker[i]),
+                "sentence_count": int(sentences_per_speaker[i]),
+            }
+            for i in range(n_speakers)
+        ]
+        meeting.update(
+            sentence_count=n_sentences,
+            speaker_count=int(n_speakers),
+            speech_ms=int(sentence_ms.sum()),
+            duration_ms=int(ends.max()),
+        )
+
+        # 词频：先 unique 计数，再只对去重后的词做过滤
+        tokens, counts = np.unique(np.char.strip(texts), return_counts=True)
+        keep = np.fromiter((_is_keyword(t) for t in tokens), dtype=bool, count=tokens.size)
+        tokens, counts = tokens[keep], counts[keep]
+        top = np.argsort(-counts, kind="stable")[:KEYWORD_LIMIT]
+        keywords = [(str(tokens[i]), int(counts[i])) for i in top]
+
+    # 音频总时长以听悟返回的为准
+    audio_duration = ((transcripts.get("Transcription") or {}).get("AudioInfo") or {}).get("Duration")
+    if audio_duration:
+        meeting["duration_ms"] = int(audio_duration)
+
+    chapter_list = chapters.get("AutoChapters") or []
+    if chapter_list:
+        chapter_start = np.fromiter((c.get("Start", 0) for c in chapter_list), dtype=np.int64, count=len(chapter_list))
+        chapter_end = np.fromiter((c.get("End", 0) for c in chapter_list), dtype=np.int64, count=len(chapter_list))
+        meeting["chapter_count"] = len(chapter_list)
+        meeting["avg_chapter_ms"] = float(np.clip(chapter_end - chapter_start, 0, None).mean())
+
+    return meeting, speaker_rows, keywords
+
+
+def materialize_for_task(task_db_id: str) -> bool:
+    """计算并写入某个 COMPLETED 任务的统计，重复调用会覆盖旧结果"""
+    with Session(engine) as db:
+        task = TaskCRUD(db).get_task(task_db_id)
+        if task is None or task.status != "COMPLETED":
+            return False
+
+        meeting, speaker_rows, keywords = compute_stats(
+            json.loads(task.transcripts) if task.transcripts else {},
+            json.loads(task.chapters) if task.chapters else {},
+        )
+
+        db.exec(delete(SpeakerStats).where(SpeakerStats.task_id == task.id))
+        db.exec(delete(KeywordStats).where(KeywordStats.task_id == task.id))
+        db.merge(MeetingStats(task_id=task.id, region=task.region, recorded_at=task.recorded_at, **meeting))
+        db.add_all(SpeakerStats(task_id=task.id, **row) for row in speaker_rows)
+        db.add_all(KeywordStats(task_id=task.id, keyword=keyword, count=count) for keyword, count in keywords)
+        db.commit()
+    return True
+
+
+def materialize_pending(limit: int = 20) -> int:
+    """补算已完成但还没有统计的任务 (历史数据 / 去重复用的结果)"""
+    with Session(engine) as db:
+        task_ids = TaskCRUD(db).get_completed_without_stats(limit + len(_failed))
+    task_ids = [task_db_id for task_db_id in task_ids if task_db_id not in _failed][:limit]
+    done = 0
+    for task_db_id in task_ids:
+        try:
+            if materialize_for_task(task_db_id):
+                done += 1
+        except Exception as e:
+            _failed.add(task_db_id)
+            logger.error(f"[Analytics] Error computing stats for {task_db_id}: {e}")
+    return done
+
+
+# --- 仪表盘聚合 (只查统计表) ---
+
+def _filtered(statement, model, start: Optional[datetime], end: Optional[datetime], region: Optional[str]):
+    if start is not None:
+        statement = statement.where(model.recorded_at >= start)
+    if end is not None:
+        statement = statement.where(model.recorded_at < end)
+    if region is not None:
+        statement = statement.where(model.region == region)
+    return statement
+
+
+def overview(db: Session, start: Optional[datetime] = None, end: Optional[datetime] = None, region: Optional[str] = None) -> dict:
+    statement = select(
+        func.count(MeetingStats.task_id),
+        func.coalesce(func.sum(MeetingStats.duration_ms), 0),
+        func.coalesce(func.sum(MeetingStats.speech_ms), 0),
+        func.coalesce(func.sum(MeetingStats.word_count), 0),
+        func.avg(MeetingStats.speaker_count),
+        func.avg(MeetingStats.duration_ms),
+        func.avg(MeetingStats.avg_chapter_ms),
+    )
+    meetings, duration, speech, words, avg_speakers, avg_duration, avg_chapter = db.exec(
+        _filtered(statement, MeetingStats, start, end, region)
+    ).one()
+    return {
+        "meetings": meetings,
+        "total_hours": duration / 3_600_000,
+        "speech_ratio": speech / duration if duration else 0.0,
+        "total_words": words,
+        "avg_speakers": float(avg_speakers or 0),
+        "avg_duration_minutes": float(avg_duration or 0) / 60_000,
+        "avg_chapter_minutes": float(avg_chapter or 0) / 60_000,
+    }
+
+
+def top_keywords(db: Session, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                 region: Optional[str] = None, limit: int = 50) -> list[dict]:
+    total = func.sum(KeywordStats.count).label("total")
+    statement = select(KeywordStats.keyword, total, func.count(KeywordStats.task_id))
+    if start is not None or end is not None or region is not None:
+        statement = _filtered(statement.join(MeetingStats, MeetingStats.task_id == KeywordStats.task_id),
+                              MeetingStats, start, end, region)
+    statement = statement.group_by(KeywordStats.keyword).order_by(total.desc()).limit(limit)
+    return [{"keyword": keyword, "count": count, "meetings": meetings} for keyword, count, meetings in db.exec(statement)]
+
+
+def meeting_stats(db: Session, task_db_id: str) -> Optional[dict]:
+    meeting = db.get(MeetingStats, task_db_id)
+    if meeting is None:
+        return None
+    speakers = db.exec(select(SpeakerStats).where(SpeakerStats.task_id == task_db_id)).all()
+    keywords = db.exec(
+        select(KeywordStats).where(KeywordStats.task_id == task_db_id).order_by(KeywordStats.count.desc())
+    ).all()
+    return {
+        **meeting.model_dump(),
+        "speakers": [s.model_dump(exclude={"task_id"}) for s in speakers],
+        "keywords": [{"keyword": k.keyword, "count": k.count} for k in keywords],
+    }
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Materialize meeting analytics")
+    parser.add_argument("--backfill", action="store_true", help="compute stats for all COMPLETED tasks without stats")
+    parser.add_argument("--batch", type=int, default=100)
+    args = parser.parse_args()
+    if args.backfill:
+        total = 0
+        while True:
+            done = materialize_pending(args.batch)
+            total += done
+            if done == 0:
+                break
+        logger.info(f"Materialized stats for {total} tasks")
@@ -1,13 +1,18 @@
 import os
 from dotenv import load_dotenv
 from typing import Literal, Optional
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 
 import http.client
 
 import asyncio
-import alibabacloud_oss_v2 as oss
-import alibabacloud_oss_v2.aio as oss_aio
+
+from lazy import lazy_import
+
+oss = lazy_import("alibabacloud_oss_v2")
+
+DEFAULT_BUCKET = 'yaps-meeting'
+VIDEO_PREFIX = 'downloaded_videos/'
 
 
 def init_client(is_async=True, region='cn-hongkong', endpoint=None):  # endpoint=Optional[Literal["internal", "custom"]]
@@ -40,6 +45,7 @@ def init_client(is_async=True, region='cn-hongkong', endpoint=None):  # endpoint
 
     # 使用配置好的信息创建OSS同步/异步客户端
     if is_async:
+        import alibabacloud_oss_v2.aio as oss_aio
         client = oss_aio.AsyncClient(cfg)
     else:
         client = oss.Client(cfg)
@@ -85,82 +91,122 @@ async def upload_file(client, key: str):
 async def get_all_files(client, bucket_name, prefix="downloaded_videos/"):
     """
     get all objects in downloaded_videos/ from aliyuncs async client
-    [item[1] for item in sorted_combined] for contents
-    [item[0] for item in sorted_combined] for dates
+    不在这里排序：录制日期入库时解析一次，排序交给数据库
+    出错时直接抛出，由调用方区分"列举失败"和"空 bucket"
     """
-    try:
-        # 创建ListObjectsV2操作的分页器
+    # 手动翻页：单次 ListObjectsV2 最多返回 1000 个对象
+    contents = []
+    continuation_token = None
+    while True:
         object = await client.list_objects_v2(oss.ListObjectsV2Request(
                 bucket=bucket_name,
-                prefix=prefix
+                prefix=prefix,
+                continuation_token=continuation_token,
+                max_keys=1000,
             ))
-
-        # print(objects)
-        sorted_combined = sort_dates(object)
-        contents = [item[1] for item in sorted_combined]
-        dates = [item[0] for item in sorted_combined]
-        return dates, contents
-    except Exception as e:
-        print("error while getting all: ",e)
-        return {}
+        contents.extend(object.contents or [])
+        if not object.is_truncated:
+            break
+        continuation_token = object.next_continuation_token
+    return contents
 
 
-def get_object_url(client, object_key) -> str:
+def get_object_url(client, object_key, bucket=DEFAULT_BUCKET, expires=None) -> str:
     """ 
     do not use asyncClient
     Get object's download url.
     Use internal client when submit to tingwu server.
     Use custom client when need a preview or download link.
+    expires: 有效秒数，不填则使用 SDK 默认的 15 分钟
     """
     try:
+        kwargs = {"expires": timedelta(seconds=expires)} if expires else {}
         pre_result = client.presign(
         oss.GetObjectRequest(
-            bucket='yaps-meeting',  # 指定存储空间名称 / hard code for now
-            key='downloaded_videos/'+object_key,        # 指定对象键名
-        ))
+            bucket=bucket,  # 指定存储空间名称
+            key=VIDEO_PREFIX+object_key,        # 指定对象键名
+        ), **kwargs)
         return pre_result.url
     
     except Exception as e:
         print("Error while getting the url: ",e)
         return 'Invalid url'
 
-def get_date(key):
-    start = key.rfind('-') + 1
-    end = key.rfind('.')
-    date = key[start:end]
-    if len(date) > 6:
-        return None
-    else:
-        return datetime.strptime(date, "%m%d%y")
+def head_object(client, object_key, bucket=DEFAULT_BUCKET):
+    """
+    do not use asyncClient
+    return (size, content_type, etag)
+    """
+    result = client.head_object(oss.HeadObjectRequest(
+        bucket=bucket,
+        key=VIDEO_PREFIX+object_key,
+    ))
+    return result.content_length, result.content_type, result.etag
 
-def sort_key(item):
-    date_val = item[0]
-    if date_val is None:
-        return(0,None)
-    else:
-        return(1,date_val)
 
-def sort_dates(result):
+def get_object_hash(client, object_key, bucket=DEFAULT_BUCKET):
     """
-    [item[1] for item in sorted_combined] for contents
-    [item[0] for item in sorted_combined] for dates
+    do not use asyncClient
+    返回 OSS 计算的 CRC64 (与分片方式无关)，对象没有时返回 None
+    """
+    result = client.head_object(oss.HeadObjectRequest(
+        bucket=bucket,
+        key=VIDEO_PREFIX+object_key,
+    ))
+    return f"crc64:{result.hash_crc64}" if result.hash_crc64 else None
+
+
+def put_object_file(client, object_key, file_path, bucket=DEFAULT_BUCKET, content_type=None):
     """
-    keys = [content.key for content in result.contents]
-    key_dates = [get_date(key) for key in keys]
-    combined = zip(key_dates, result.contents)
-    sorted_combined = sorted(combined, key=sort_key, reverse=True)
-    sorted_content = [item[1] for item in sorted_combined]
-    return sorted_combined
+    do not use asyncClient
+    上传本地文件到 downloaded_videos/ 下，返回 ETag
+    """
+    result = client.put_object_from_file(oss.PutObjectRequest(
+        bucket=bucket,
+        key=VIDEO_PREFIX+object_key,
+        content_type=content_type,
+    ), file_path)
+    return result.etag
+
+
+def iter_object(client, object_key, start, end, bucket=DEFAULT_BUCKET, chunk_size=256 * 1024):
+    """
+    do not use asyncClient
+    按 Range 读取 [start, end] 字节，每次只产出 chunk_size 大小，整个对象不会进内存
+    """
+    result = client.get_object(oss.GetObjectRequest(
+        bucket=bucket,
+        key=VIDEO_PREFIX+object_key,
+        range_header=f"bytes={start}-{end}",
+        range_behavior="standard",
+    ))
+    try:
+        for chunk in result.body.iter_bytes(block_size=chunk_size):
+            yield chunk
+    finally:
+        result.body.close()
+
+def get_date(key):
+    """
+    解析文件名末尾的 -MMDDYY 录制日期，解析失败返回 None (由调用方决定回退方式)
+    """
+    start = key.rfind('-') + 1
+    end = key.rfind('.')
+    date = key[start:end] if end > start else key[start:]
+    if len(date) != 6 or not date.isdigit():
+        return None
+    try:
+        return datetime.strptime(date, "%m%d%y").replace(tzinfo=timezone.utc)
+    except ValueError:
+        return None
 
     
 async def main():
     bucket_name = 'yaps-meeting'
     client = init_client()
-    result = await get_all_files(client, bucket_name)
-    sorted_dates = sort_dates(result)
-    sorted_content = [item[1] for item in sorted_dates]
-    for index, item in enumerate(sorted_dates):
-        print(sorted_content[index], item[0])
+    contents = await get_all_files(client, bucket_name)
+    for item in contents:
+        print(item.key, get_date(item.key))
     # print(sorted_dates)
     # await client.close()
 
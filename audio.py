@@ -0,0 +1,114 @@
+"""
+提交听悟前的音频抽取 (可选)：ffmpeg 通过预签名链接流式读取原视频，只转出单声道低码率音轨，
+上传到原文件旁边 (xxx.mp4 -> xxx.mp4.audio.m4a)，提交听悟时用音频代替整段视频
+
+    AUDIO_EXTRACT=1          开启 (还需要 PATH 里有 ffmpeg，否则自动跳过)
+    AUDIO_BITRATE=32k        输出码率，16kHz 单声道语音 32k 足够
+    AUDIO_MIN_BYTES=20MB     小于该大小的文件直接提交原文件，不值得抽取
+    AUDIO_CONCURRENCY=2      每个实例同时转码的文件数
+
+转码在任务认领 (PREPARING) 之后由后台任务执行，不阻塞 worker 主循环；认领保证多实例不会重复转码
+"""
+import os
+import shutil
+import logging
+import tempfile
+import subprocess
+from typing import Optional
+
+from sqlmodel import Session
+
+import buckets
+from databacy import engine, TaskCRUD
+
+logger = logging.getLogger(__name__)
+
+AUDIO_SUFFIX = ".audio.m4a"
+AUDIO_BITRATE = os.getenv("AUDIO_BITRATE", "32k")
+AUDIO_MIN_BYTES = int(os.getenv("AUDIO_MIN_BYTES", str(20 * 1024 * 1024)))
+AUDIO_TIMEOUT = int(os.getenv("AUDIO_TIMEOUT", "3600"))  # 单个文件 ffmpeg 最长运行秒数
+AUDIO_CONCURRENCY = int(os.getenv("AUDIO_CONCURRENCY", "2"))
+
+# 本身就是音频的文件不再转码
+AUDIO_EXTENSIONS = (".mp3", ".m4a", ".aac", ".wav", ".wma", ".ogg", ".opus", ".flac", ".amr")
+
+
+def ffmpeg_path() -> Optional[str]:
+    return shutil.which(os.getenv("FFMPEG_BIN", "ffmpeg"))
+
+
+def enabled() -> bool:
+    return os.getenv("AUDIO_EXTRACT", "0") == "1" and ffmpeg_path() is not None
+
+
+def is_audio_key(object_key: str) -> bool:
+    """抽取出的音频文件，同步 OSS 列表时要跳过，不能当成新会议入库"""
+    return object_key.endswith(AUDIO_SUFFIX)
+
+
+def should_extract(object_key: str, size: int) -> bool:
+    return (size or 0) >= AUDIO_MIN_BYTES and not object_key.lower().endswith(AUDIO_EXTENSIONS)
+
+
+def extract_audio(source_url: str, output_path: str):
+    """
+    ffmpeg 按需 Range 读取远端文件 (moov 在末尾也能处理)，本地只落一个小的音频文件
+    """
+    cmd = [
+        ffmpeg_path(), "-nostdin", "-hide_banner", "-loglevel", "error", "-y",
+        "-reconnect", "1", "-reconnect_on_network_error", "1", "-reconnect_delay_max", "10",
+        "-i", source_url,
+        "-vn", "-sn", "-dn",
+        "-ac", "1", "-ar", "16000",
+        "-c:a", "aac", "-b:a", AUDIO_BITRATE,
+        "-movflags", "+faststart",
+        output_path,
+    ]
+    result = subprocess.run(cmd, capture_output=True, text=True, timeout=AUDIO_TIMEOUT)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg exited with {result.returncode}: {result.stderr.strip()[-500:]}")
+
+
+def prepare_audio(task_db_id: str, entry) -> Optional[str]:
+    """
+    为任务准备音频衍生文件，返回音频的 object_key；不需要/失败时返回 None，调用方提交原文件
+    重试时已有的 audio_key 直接复用
+    """
+    with Session(engine) as db:
+        task = TaskCRUD(db).get_task(task_db_id)
+        if task is None:
+            return None
+        if task.audio_key:
+            return task.audio_key
+        object_key, size = task.object_key, task.size
+
+    if not should_extract(object_key, size):
+        return None
+
+    module = buckets.storage_module(entry)
+    client = buckets.get_client(entry, "rw")
+    audio_key = object_key + AUDIO_SUFFIX
+
+    fd, output_path = tempfile.mkstemp(suffix=".m4a")
+    os.close(fd)
+    try:
+        # ffmpeg 断线重连时复用同一个链接，有效期要覆盖整个转码过程 (OSS 默认只有 15 分钟)
+        source_url = module.get_object_url(client, object_key, bucket=entry.bucket, expires=AUDIO_TIMEOUT + 600)
+        extract_audio(source_url, output_path)
+        audio_size = os.path.getsize(output_path)
+        module.put_object_file(client, audio_key, output_path, bucket=entry.bucket, content_type="audio/mp4")
+    except Exception as e:
+        logger.error(f"[Audio] Extraction failed for {object_key}, submitting original: {e}")
+        return None
+    finally:
+        os.remove(output_path)
+
+    with Session(engine) as db:
+        crud = TaskCRUD(db)
+        task = crud.get_task(task_db_id)
+        if task is not None:
+            crud.update_task(task, audio_key=audio_key, audio_size=audio_size)
+
+    ratio = size / audio_size if audio_size else 0
+    logger.info(f"[Audio] {object_key}: {size / 1e6:.1f} MB -> {audio_size / 1e6:.1f} MB ({ratio:.0f}x smaller)")
+    return audio_key
@@ -0,0 +1,84 @@
+"""
+导出吞吐基准：在临时 SQLite 中生成 N 条 COMPLETED 会议，测量 NDJSON / Parquet 导出速度与峰值内存
+
+    python bench_export.py --meetings 10000 --sentences 40
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+
+
+def build_archive(n: int, sentences: int):
+    from sqlalchemy import insert
+    from databacy import engine, init_db, Task
+
+    init_db()
+    transcripts = json.dumps({"Transcription": {"Paragraphs": [
+        {"SpeakerId": str(i % 3), "Words": [{"Text": "会议内容示例", "Start": i * 1000, "End": i * 1000 + 900}]}
+        for i in range(sentences)
+    ]}}, ensure_ascii=False)
+    summary = json.dumps({"Summarization": {"ParagraphSummary": "摘要" * 50}}, ensure_ascii=False)
+    base = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+    rows = []
+    with engine.begin() as conn:
+        for i in range(n):
+            rows.append({
+                "id": f"task-{i:06d}", "object_key": f"meeting-{i}.mp4", "region": "cn-hongkong",
+                "bucket": "yaps-meeting", "size": 1024 * 1024 * 500, "task_id": f"tw-{i}", "status": "COMPLETED",
+                "query_res": "{}", "chapters": "{}", "summary": summary, "transcripts": transcripts,
+                "created_at": base, "last_modified": "", "recorded_at": base + timedelta(hours=i), "version": 0,
+            })
+            if len(rows) >= 1000:
+                conn.execute(insert(Task), rows)
+                rows = []
+        if rows:
+            conn.execute(insert(Task), rows)
+
+
+def run(fmt: str):
+    import export
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    total_bytes = 0
+    for chunk in export.export_stream(fmt):
+        total_bytes += len(chunk)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, total_bytes, peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--meetings", type=int, default=10000)
+    parser.add_argument("--sentences", type=int, default=40)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # 必须在 import databacy 之前设置
+        os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(tmp, 'bench.db')}"
+        build_archive(args.meetings, args.sentences)
+
+        formats = ["ndjson"]
+        try:
+            import pyarrow  # noqa: F401
+            formats.append("parquet")
+        except ImportError:
+            print("pyarrow not installed, skip parquet", file=sys.stderr)
+
+        for fmt in formats:
+            elapsed, total_bytes, peak = run(fmt)
+            print(f"{fmt:8s} {args.meetings} meetings in {elapsed:.2f}s "
+                  f"({args.meetings / elapsed:.0f} rows/s, {total_bytes / elapsed / 1024 / 1024:.1f} MiB/s), "
+                  f"output {total_bytes / 1024 / 1024:.1f} MiB, peak python memory {peak / 1024 / 1024:.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
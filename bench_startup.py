@@ -0,0 +1,106 @@
+"""
+冷启动基准：import main 的耗时，以及从启动进程到 /api/users/me 第一次返回 200 的耗时
+
+    python bench_startup.py --runs 5 --max-import 1.5 --max-first-request 4
+
+超过阈值时退出码为 1，可放进 CI 防止冷启动回退
+"""
+import os
+import sys
+import time
+import socket
+import argparse
+import statistics
+import subprocess
+import tempfile
+import urllib.request
+import urllib.error
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+IMPORT_SNIPPET = "import time; t = time.perf_counter(); import main; print(time.perf_counter() - t)"
+
+PREPARE_SNIPPET = """
+from sqlmodel import Session
+from databacy import engine, init_db, User
+from auth import create_access_token
+init_db()
+with Session(engine) as db:
+    db.add(User(agent_code="bench", hashed_password="x"))
+    db.commit()
+print(create_access_token(data={"sub": "bench"}))
+"""
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def measure_import(env) -> float:
+    out = subprocess.run([sys.executable, "-c", IMPORT_SNIPPET], cwd=ROOT, env=env,
+                         capture_output=True, text=True, check=True)
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def measure_first_request(env, token: str, timeout: float = 60) -> float:
+    port = free_port()
+    started = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    request = urllib.request.Request(f"http://127.0.0.1:{port}/api/users/me",
+                                     headers={"Cookie": f'access_token="Bearer {token}"'})
+    try:
+        while time.perf_counter() - started < timeout:
+            try:
+                with urllib.request.urlopen(request, timeout=1) as resp:
+                    if resp.status == 200:
+                        return time.perf_counter() - started
+            except (urllib.error.URLError, ConnectionError, OSError):
+                pass
+            time.sleep(0.01)
+        raise TimeoutError("server did not answer /api/users/me in time")
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-import", type=float, help="fail if median import time (s) exceeds this")
+    parser.add_argument("--max-first-request", type=float, help="fail if median time to first /api/users/me (s) exceeds this")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = {
+            **os.environ,
+            "DATABASE_URL": f"sqlite:///{os.path.join(tmp, 'bench.db')}",
+            "SECRET_KEY": "bench-secret",
+        }
+        token = subprocess.run([sys.executable, "-c", PREPARE_SNIPPET], cwd=ROOT, env=env,
+                               capture_output=True, text=True, check=True).stdout.strip().splitlines()[-1]
+
+        import_times = [measure_import(env) for _ in range(args.runs)]
+        first_request_times = [measure_first_request(env, token) for _ in range(args.runs)]
+
+    import_median = statistics.median(import_times)
+    first_median = statistics.median(first_request_times)
+    print(f"import main:           median {import_median:.3f}s  (min {min(import_times):.3f}s, max {max(import_times):.3f}s)")
+    print(f"first /api/users/me:   median {first_median:.3f}s  (min {min(first_request_times):.3f}s, max {max(first_request_times):.3f}s)")
+
+    failed = False
+    if args.max_import is not None and import_median > args.max_import:
+        print(f"FAIL: import time {import_median:.3f}s > {args.max_import}s")
+        failed = True
+    if args.max_first_request is not None and first_median > args.max_first_request:
+        print(f"FAIL: time to first request {first_median:.3f}s > {args.max_first_request}s")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
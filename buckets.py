@@ -0,0 +1,138 @@
+import os
+import asyncio
+import logging
+from typing import NamedTuple, Optional
+
+import aos
+import vtos
+
+logger = logging.getLogger(__name__)
+
+
+def get_tos_config(region: str):
+    match region:
+        case "guangzhou":
+            return "yings-meeting", "tos-cn-guangzhou.volces.com"
+        case "hongkong":
+            return "bucket4hk", "tos-cn-hongkong.volces.com"
+        case _:
+            raise ValueError(f"Unknown region: {region}")
+
+
+class BucketEntry(NamedTuple):
+    provider: str                           # "oss" (阿里云) / "tos" (火山引擎)
+    region: str
+    bucket: str
+    submit_endpoint: Optional[str] = None   # OSS 提交听悟时用的 endpoint: internal / custom / None(公网)
+
+
+# 格式: provider:region[:bucket[:submit_endpoint]]，逗号分隔
+# TOS 不填 bucket 时由 get_tos_config 决定
+DEFAULT_BUCKETS = "oss:cn-hongkong:yaps-meeting:custom"
+
+
+def load_registry(spec: Optional[str] = None) -> list[BucketEntry]:
+    spec = spec if spec is not None else os.getenv("STORAGE_BUCKETS", DEFAULT_BUCKETS)
+    entries = []
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        parts = item.split(":")
+        if len(parts) < 2 or parts[0] not in ("oss", "tos"):
+            raise ValueError(f"Invalid bucket spec: {item!r}")
+        provider, region = parts[0], parts[1]
+        bucket = parts[2] if len(parts) > 2 and parts[2] else None
+        submit_endpoint = parts[3] if len(parts) > 3 and parts[3] else None
+        if bucket is None:
+            if provider != "tos":
+                raise ValueError(f"Missing bucket name: {item!r}")
+            bucket, _ = get_tos_config(region)
+        entries.append(BucketEntry(provider, region, bucket, submit_endpoint))
+    return entries
+
+
+REGISTRY = load_registry()
+
+
+def get_entry(region: str, bucket: Optional[str] = None) -> BucketEntry:
+    """
+    按 region (和 bucket) 查找登记的存储桶；未登记但 get_tos_config 认识的 region 视为 TOS
+    """
+    for entry in REGISTRY:
+        if entry.region == region and (bucket is None or entry.bucket == bucket):
+            return entry
+    tos_bucket, _ = get_tos_config(region)
+    if bucket is not None and bucket != tos_bucket:
+        raise ValueError(f"Unknown bucket: {region}/{bucket}")
+    return BucketEntry("tos", region, tos_bucket)
+
+
+def region_entries(region: str) -> list[BucketEntry]:
+    """某个 region 下登记的所有存储桶"""
+    return [entry for entry in REGISTRY if entry.region == region]
+
+
+def storage_module(entry: BucketEntry):
+    """aos / vtos 提供同名的 get_object_url / head_object / get_object_hash / iter_object / put_object_file"""
+    return aos if entry.provider == "oss" else vtos
+
+
+# --- 客户端池：每个 (provider, region, 用途) 只建一个客户端 ---
+_clients = {}
+
+def get_client(entry: BucketEntry, kind: str = "sign"):
+    """
+    kind:
+        list   -> 列举用 (OSS 为异步客户端)
+        sign   -> 预览/下载链接 (OSS 走自定义域名)
+        submit -> 给听悟拉取文件
+        rw     -> 服务端读写 (音频抽取的源链接和上传，OSS 走默认公网 endpoint)
+    """
+    pool_key = (entry.provider, entry.region, kind, entry.submit_endpoint if kind == "submit" else None)
+    if pool_key not in _clients:
+        if entry.provider == "oss":
+            match kind:
+                case "list":
+                    client = aos.init_client(is_async=True, region=entry.region)
+                case "sign":
+                    client = aos.init_client(is_async=False, region=entry.region, endpoint='custom')
+                case "submit":
+                    client = aos.init_client(is_async=False, region=entry.region, endpoint=entry.submit_endpoint)
+                case "rw":
+                    client = aos.init_client(is_async=False, region=entry.region)
+                case _:
+                    raise ValueError(f"Unknown client kind: {kind}")
+        else:
+            # TOS 只有一个同步客户端，公网 endpoint 就是该 region 最近的入口
+            _, endpoint = get_tos_config(entry.region)
+            client = _clients.setdefault(("tos", entry.region, "sign", None), vtos.init_client(endpoint))
+        _clients[pool_key] = client
+    return _clients[pool_key]
+
+
+def get_submit_url(entry: BucketEntry, object_key: str) -> str:
+    module = storage_module(entry)
+    return module.get_object_url(get_client(entry, "submit"), object_key, bucket=entry.bucket)
+
+
+async def list_entry(entry: BucketEntry):
+    if entry.provider == "oss":
+        return await aos.get_all_files(get_client(entry, "list"), entry.bucket)
+    return await asyncio.to_thread(vtos.get_all_files, get_client(entry, "list"), entry.bucket)
+
+
+async def list_all_buckets(entries: Optional[list[BucketEntry]] = None):
+    """
+    并发列举所有登记的存储桶，耗时取决于最慢的那个
+    返回 [(entry, contents)]，失败的桶记日志后跳过
+    """
+    entries = entries if entries is not None else REGISTRY
+    results = await asyncio.gather(*(list_entry(entry) for entry in entries), return_exceptions=True)
+    listed = []
+    for entry, result in zip(entries, results):
+        if isinstance(result, Exception):
+            logger.error(f"Error listing {entry.provider}:{entry.region}/{entry.bucket}: {result}")
+            continue
+        listed.append((entry, result))
+    return listed
@@ -0,0 +1,111 @@
+import os
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class DetailCache:
+    """
+    会议详情的读穿缓存，key = (task_id, version)
+    本地: 按字节数限制大小的 LRU；可选共享层: Redis 兼容服务 (DETAIL_CACHE_REDIS_URL)
+    缓存的是已经序列化好的 JSON bytes，命中时不需要再 json.loads / 重新编码
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, redis_url: Optional[str] = None, ttl: int = 600):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._local = OrderedDict()  # task_id -> (version, payload)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "shared_hits": 0, "misses": 0, "invalidations": 0}
+        self._redis = None
+        if redis_url:
+            try:
+                import redis
+                self._redis = redis.Redis.from_url(redis_url)
+            except ImportError:
+                logger.warning("DETAIL_CACHE_REDIS_URL is set but redis is not installed, using local cache only")
+
+    @staticmethod
+    def _shared_key(task_id: str, version: int) -> str:
+        return f"detail:{task_id}:{version}"
+
+    def _put_local(self, task_id: str, version: int, payload: bytes):
+        with self._lock:
+            old = self._local.pop(task_id, None)
+            if old is not None:
+                self._bytes -= len(old[1])
+            if len(payload) > self.max_bytes:
+                return
+            self._local[task_id] = (version, payload)
+            self._bytes += len(payload)
+            while self._bytes > self.max_bytes:
+                _, (_, evicted) = self._local.popitem(last=False)
+                self._bytes -= len(evicted)
+
+    def get(self, task_id: str, version: int) -> Optional[bytes]:
+        with self._lock:
+            cached = self._local.get(task_id)
+            if cached is not None and cached[0] == version:
+                self._local.move_to_end(task_id)
+                self._stats["hits"] += 1
+                return cached[1]
+
+        if self._redis is not None:
+            try:
+                payload = self._redis.get(self._shared_key(task_id, version))
+            except Exception as e:
+                logger.warning(f"[Cache] Shared backend get failed: {e}")
+                payload = None
+            if payload is not None:
+                self._put_local(task_id, version, payload)
+                with self._lock:
+                    self._stats["shared_hits"] += 1
+                return payload
+
+        with self._lock:
+            self._stats["misses"] += 1
+        return None
+
+    def set(self, task_id: str, version: int, payload: bytes):
+        self._put_local(task_id, version, payload)
+        if self._redis is not None:
+            try:
+                self._redis.set(self._shared_key(task_id, version), payload, ex=self.ttl)
+            except Exception as e:
+                logger.warning(f"[Cache] Shared backend set failed: {e}")
+
+    def invalidate(self, task_id: str, version: Optional[int] = None):
+        """行被修改后调用；version 为修改前的版本号，用于删除共享层中的旧 key"""
+        with self._lock:
+            old = self._local.pop(task_id, None)
+            if old is not None:
+                self._bytes -= len(old[1])
+            self._stats["invalidations"] += 1
+        if self._redis is not None and version is not None:
+            try:
+                self._redis.delete(self._shared_key(task_id, version))
+            except Exception as e:
+                logger.warning(f"[Cache] Shared backend delete failed: {e}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["shared_hits"] + self._stats["misses"]
+            return {
+                **self._stats,
+                "hit_rate": (self._stats["hits"] + self._stats["shared_hits"]) / lookups if lookups else 0.0,
+                "entries": len(self._local),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "shared_backend": self._redis is not None,
+            }
+
+
+detail_cache = DetailCache(
+    max_bytes=int(os.getenv("DETAIL_CACHE_MAX_BYTES", 64 * 1024 * 1024)),
+    redis_url=os.getenv("DETAIL_CACHE_REDIS_URL"),
+    ttl=int(os.getenv("DETAIL_CACHE_TTL", 600)),
+)
@@ -1,12 +1,21 @@
 import os
 import json
-from datetime import datetime, timezone
+import hashlib
+import logging
+from datetime import date, datetime, timezone
 from typing import Optional, List, Dict, Any
 
 # 引入 SQLModel 及相关组件
 from sqlmodel import SQLModel, Field, Session, select, create_engine
 # 引入 SQLAlchemy 类型以保持数据库 Schema 的精确控制 (Text, BigInteger)
-from sqlalchemy import Column, Text, BigInteger, DateTime
+from sqlalchemy import Column, Text, BigInteger, DateTime, Index, inspect, text, or_, func, update, type_coerce, exists
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import aliased
+
+import events
+from cache import detail_cache
+
+logger = logging.getLogger(__name__)
 
 # 1. 数据库 URL 配置 (保持不变)
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///yaps.db")
@@ -23,12 +32,26 @@ else:
 
 # 3. 创建引擎 (使用 SQLModel 的 create_engine，本质是 SQLAlchemy 的封装)
 engine = create_engine(DATABASE_URL, connect_args=connect_args)
+IS_POSTGRES = engine.dialect.name == "postgresql"
+
+# 终态：进入时记录 finished_at，用于统计吞吐和失败率
+# ORPHANED: 提交中途中断，听悟侧可能已受理，需要人工按 submit_key 核对后再重试
+FINISHED_STATUSES = ("COMPLETED", "FAILED", "DEAD", "ORPHANED")
 
 # 4. 定义模型
 class Task(SQLModel, table=True):
+    # 状态汇总只扫这两个索引，不读 blob 列
+    __table_args__ = (
+        # 任务身份是 (region, bucket, object_key)，并发同步也不能重复入库
+        Index("ux_task_location", "region", "bucket", "object_key", unique=True),
+        Index("ix_task_status_region", "status", "region"),
+        Index("ix_task_status_finished_at", "status", "finished_at"),
+    )
+
     id: str = Field(primary_key=True)
     object_key: str = Field(index=True)
     region: str = Field(default="hongkong")
+    bucket: Optional[str] = Field(default=None, index=True)
     
     # 使用 sa_column 强制使用 BigInteger，对应原代码的 BigInteger
     size: int = Field(default=0, sa_column=Column(BigInteger))
@@ -50,6 +73,67 @@ class Task(SQLModel, table=True):
     
     last_modified: str = Field(default="")
 
+    # 录制日期：入库时从文件名 -MMDDYY 解析一次，排序/筛选都在 SQL 里完成
+    recorded_at: Optional[datetime] = Field(
+        default=None,
+        sa_column=Column(DateTime(timezone=True), index=True)
+    )
+
+    # 内容指纹：用于识别重复上传，相同内容直接复用已完成的转写结果
+    etag: Optional[str] = Field(default=None, index=True)
+    content_hash: Optional[str] = Field(default=None, index=True)
+    dedup_of: Optional[str] = Field(default=None)  # 复用了哪条 Task 的结果
+
+    # 提交状态机: NONE -> PREPARING -> SUBMITTING -> ONGOING -> COMPLETED / FAILED，超过重试预算进入 DEAD，
+    # SUBMITTING 中断 (不确定听悟是否已受理) 进入 ORPHANED
+    submit_attempts: Optional[int] = Field(default=0)
+    submit_key: Optional[str] = Field(default=None)  # 提交给听悟的 task_key，每行固定不变，用于对账
+    submitting_at: Optional[datetime] = Field(default=None, sa_column=Column(DateTime(timezone=True)))  # 最近一次认领时间
+    last_error: Optional[str] = Field(default=None, sa_column=Column(Text))
+
+    # 调度: priority 越大越先提交；按需加急时记录请求人和加急时间 (queued_at，只用于统计加急后的排队时长)
+    priority: Optional[int] = Field(default=0, index=True)
+    requested_by: Optional[str] = Field(default=None)
+    queued_at: Optional[datetime] = Field(default=None, sa_column=Column(DateTime(timezone=True)))
+
+    # 音频衍生文件 (audio.py)：提交听悟时用它代替原视频，size 仍是原文件大小
+    audio_key: Optional[str] = Field(default=None)
+    audio_size: Optional[int] = Field(default=None, sa_column=Column(BigInteger))
+
+    # 进入 COMPLETED / FAILED / DEAD 的时间
+    finished_at: Optional[datetime] = Field(default=None, sa_column=Column(DateTime(timezone=True)))
+
+    # 每次修改 +1，详情缓存以 (id, version) 为 key
+    version: Optional[int] = Field(default=0)
+
+# 会议统计 (任务完成时计算一次)，仪表盘只查这几张小表，不碰 transcripts blob
+class MeetingStats(SQLModel, table=True):
+    task_id: str = Field(primary_key=True)  # Task.id
+    region: str = Field(default="", index=True)
+    recorded_at: Optional[datetime] = Field(
+        default=None,
+        sa_column=Column(DateTime(timezone=True), index=True)
+    )
+    duration_ms: int = Field(default=0, sa_column=Column(BigInteger))
+    speech_ms: int = Field(default=0, sa_column=Column(BigInteger))  # 有人说话的总时长
+    word_count: int = Field(default=0)
+    sentence_count: int = Field(default=0)
+    speaker_count: int = Field(default=0)
+    chapter_count: int = Field(default=0)
+    avg_chapter_ms: float = Field(default=0.0)
+
+class SpeakerStats(SQLModel, table=True):
+    task_id: str = Field(primary_key=True)
+    speaker_id: str = Field(primary_key=True)
+    talk_ms: int = Field(default=0, sa_column=Column(BigInteger))
+    word_count: int = Field(default=0)
+    sentence_count: int = Field(default=0)
+
+class KeywordStats(SQLModel, table=True):
+    task_id: str = Field(primary_key=True)
+    keyword: str = Field(primary_key=True, index=True)
+    count: int = Field(default=0)
+
 class User(SQLModel, table=True):
     # id 是主键，Optional 是因为创建新用户时 id 还没生成（由数据库生成）
     id: Optional[int] = Field(default=None, primary_key=True)
@@ -68,9 +152,88 @@ class UserRead(SQLModel):
     agent_code: str
     username: Optional[str] = '未设置用户名'
 
+class SchemaMeta(SQLModel, table=True):
+    # 记录上次建表/迁移时的 schema 指纹，指纹不变则启动时跳过检查
+    key: str = Field(primary_key=True)
+    value: str = Field(default="")
+
+def schema_fingerprint() -> str:
+    parts = []
+    for table in SQLModel.metadata.sorted_tables:
+        for column in table.columns:
+            parts.append(f"{table.name}.{column.name}:{column.type}")
+        for index in table.indexes:
+            parts.append(f"{table.name}#{index.name}")
+    return hashlib.sha1("\n".join(sorted(parts)).encode()).hexdigest()
+
+def _stored_fingerprint() -> Optional[str]:
+    try:
+        with Session(engine) as db:
+            meta = db.get(SchemaMeta, "fingerprint")
+            return meta.value if meta else None
+    except Exception:
+        # 表还不存在 (首次部署)
+        return None
+
 # 初始化数据库
-def init_db():
+def init_db(force: bool = False) -> bool:
+    """
+    schema 没变时只做一次主键查询；有变化 (或 force) 才 create_all + 补列，返回是否执行了检查
+    """
+    fingerprint = schema_fingerprint()
+    if not force and _stored_fingerprint() == fingerprint:
+        return False
     SQLModel.metadata.create_all(engine)
+    if not migrate_db():
+        # 唯一索引没建成：不记录指纹，下次启动再试
+        return True
+    with Session(engine) as db:
+        db.merge(SchemaMeta(key="fingerprint", value=fingerprint))
+        db.commit()
+    return True
+
+def migrate_db() -> bool:
+    """
+    create_all 不会给已存在的表加列，这里补上模型中新增的列和索引
+    已有重复数据时唯一索引会建失败：记日志后继续启动，返回 False
+    """
+    ok = True
+    inspector = inspect(engine)
+    for table in SQLModel.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {c["name"] for c in inspector.get_columns(table.name)}
+        with engine.begin() as conn:
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                col_type = column.type.compile(dialect=engine.dialect)
+                conn.execute(text(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {col_type}'))
+            for index in table.indexes:
+                if not index.unique:
+                    index.create(conn, checkfirst=True)
+        for index in table.indexes:
+            if not index.unique:
+                continue
+            try:
+                with engine.begin() as conn:
+                    index.create(conn, checkfirst=True)
+            except IntegrityError as e:
+                ok = False
+                logger.error(f"Cannot create unique index {index.name}, remove duplicate rows first: {e.orig}")
+    return ok
+
+def to_utc_datetime(d: Optional[date]) -> Optional[datetime]:
+    """日期 -> 当天 00:00 UTC，用于 recorded_at 区间筛选"""
+    if d is None:
+        return None
+    return datetime(d.year, d.month, d.day, tzinfo=timezone.utc)
+
+def bump_version(task: Task) -> int:
+    """版本号 +1，返回修改前的版本号"""
+    old_version = task.version or 0
+    task.version = old_version + 1
+    return old_version
 
 # CRUD 类
 class TaskCRUD:
@@ -85,7 +248,9 @@ class TaskCRUD:
         # SQLModel 直接通过关键字参数解包创建实例
         db_task = Task(**task_data)
         self.db.add(db_task)
+        event = self._status_changed(db_task, None)
         self.db.commit()
+        self._publish(event)
         self.db.refresh(db_task)
         return db_task
 
@@ -98,13 +263,218 @@ class TaskCRUD:
         statement = select(Task).where(Task.object_key == object_key)
         return self.db.exec(statement).first()
 
+    def get_task_by_location(self, region: str, bucket: str, object_key: str) -> Optional[Task]:
+        """bucket 还没补齐的旧记录 (bucket IS NULL) 也算同一个位置，精确匹配优先"""
+        statement = (
+            select(Task)
+            .where(Task.region == region, Task.object_key == object_key,
+                   or_(Task.bucket == bucket, Task.bucket == None))  # noqa: E711
+            .order_by(Task.bucket.is_(None))
+        )
+        return self.db.exec(statement).first()
+
+    def get_pending_for_submission(self, per_group: int = 20):
+        """
+        待提交任务的候选：每个 (region, 请求人) 分组各取前 per_group 条，
+        组内优先级高的在前，同优先级按录制日期倒序 (最新的会议先转写)；
+        按组取候选，某个区域积压再多也不会把其他分组挤出候选集，交给 scheduler.fair_order 轮转
+        """
+        order = (func.coalesce(Task.priority, 0).desc(), Task.recorded_at.desc().nulls_last())
+        ranked = (
+            select(
+                Task.id,
+                func.row_number().over(
+                    partition_by=(Task.region, func.coalesce(Task.requested_by, "")),
+                    order_by=order,
+                ).label("rank"),
+            )
+            .where(Task.status == "NONE")
+            .subquery()
+        )
+        statement = (
+            select(Task)
+            .join(ranked, ranked.c.id == Task.id)
+            .where(ranked.c.rank <= per_group)
+            .order_by(*order)
+        )
+        return self.db.exec(statement).all()
+
+    def get_status_summary(self, since: datetime) -> Dict[str, Any]:
+        """
+        状态汇总，全部走 GROUP BY / 聚合，只涉及 status、region 和几个时间列
+        since: 统计吞吐和失败率的窗口起点
+        """
+        counts = self.db.exec(
+            select(Task.status, Task.region, func.count()).group_by(Task.status, Task.region)
+        ).all()
+
+        oldest_pending = self.db.exec(
+            # 用入库时间：加急会刷新 queued_at，不能让积压看起来变"年轻"
+            select(type_coerce(func.min(Task.created_at), DateTime(timezone=True)))
+            .where(Task.status.in_(("NONE", "PREPARING", "SUBMITTING")))
+        ).one()
+
+        finished = self.db.exec(
+            select(Task.status, func.count())
+            .where(Task.status.in_(FINISHED_STATUSES), Task.finished_at >= since)
+            .group_by(Task.status)
+        ).all()
+
+        return {"counts": counts, "oldest_pending": oldest_pending, "finished": dict(finished)}
+
+    def get_completed_without_stats(self, limit: int = 20) -> List[str]:
+        statement = (
+            select(Task.id)
+            .outerjoin(MeetingStats, MeetingStats.task_id == Task.id)
+            .where(Task.status == "COMPLETED", MeetingStats.task_id == None)  # noqa: E711
+            .limit(limit)
+        )
+        return list(self.db.exec(statement).all())
+
+    def get_task_refs(self, task_db_id: Optional[str] = None, object_key: Optional[str] = None,
+                      region: Optional[str] = None, bucket: Optional[str] = None, limit: int = 2):
+        """
+        只取轻量字段 (不读 blob)，用于判断详情缓存是否命中
+        同一个 object_key 可能存在于多个 bucket，按 id 或 (region, bucket, key) 定位；最多返回 limit 条供调用方判断是否有歧义
+        """
+        statement = select(Task.id, Task.version, Task.region, Task.bucket, Task.object_key)
+        if task_db_id is not None:
+            statement = statement.where(Task.id == task_db_id)
+        if object_key is not None:
+            statement = statement.where(Task.object_key == object_key)
+        if region is not None:
+            statement = statement.where(Task.region == region)
+        if bucket is not None:
+            statement = statement.where(or_(Task.bucket == bucket, Task.bucket == None))  # noqa: E711
+        return self.db.exec(statement.limit(limit)).all()
+
     def get_tasks_by_status(self, status: str):
         """通用状态获取函数"""
         statement = select(Task).where(Task.status == status)
         return self.db.exec(statement).all()
 
+    def list_tasks(self, start: Optional[datetime] = None, end: Optional[datetime] = None):
+        """按录制日期倒序列出任务，可选日期区间 [start, end)"""
+        statement = select(Task)
+        if start is not None:
+            statement = statement.where(Task.recorded_at >= start)
+        if end is not None:
+            statement = statement.where(Task.recorded_at < end)
+        statement = statement.order_by(Task.recorded_at.desc().nulls_last(), Task.object_key)
+        return self.db.exec(statement).all()
+
+    def get_regions_missing_bucket(self) -> List[str]:
+        statement = select(Task.region).where(Task.bucket == None).distinct()  # noqa: E711
+        return list(self.db.exec(statement).all())
+
+    def fill_missing_bucket(self, region: str, bucket: str) -> int:
+        """
+        旧数据没有记录 bucket，按 region 一条 UPDATE 补上 (不读整行)
+        同一位置已有带 bucket 的记录时跳过，避免违反唯一索引；这些旧记录仍按 bucket IS NULL 匹配
+        """
+        other = aliased(Task)
+        result = self.db.exec(
+            update(Task)
+            .where(
+                Task.region == region,
+                Task.bucket == None,  # noqa: E711
+                ~exists().where(other.region == region, other.bucket == bucket, other.object_key == Task.object_key),
+            )
+            .values(bucket=bucket, version=func.coalesce(Task.version, 0) + 1)
+        )
+        self.db.commit()
+        return result.rowcount
+
+    def get_tasks_missing_recorded_at(self):
+        statement = select(Task).where(Task.recorded_at == None)  # noqa: E711
+        return self.db.exec(statement).all()
+
+    def _claim(self, task_db_id: str, expected: str, new_status: str, **values) -> Optional[Task]:
+        """原子地把 expected 改为 new_status；已被别的 worker/实例认领时返回 None"""
+        now = datetime.now(timezone.utc)
+        statement = (
+            update(Task)
+            .where(Task.id == task_db_id, Task.status == expected)
+            .values(
+                status=new_status,
+                submitting_at=now,
+                version=func.coalesce(Task.version, 0) + 1,
+                last_modified=now.strftime("%Y-%m-%d %H:%M:%S"),
+                **values,
+            )
+        )
+        result = self.db.exec(statement)
+        if result.rowcount != 1:
+            self.db.rollback()
+            return None
+        task = self.get_task(task_db_id)
+        self.db.refresh(task)
+        event = self._status_changed(task, expected)
+        self.db.commit()
+        self._publish(event)
+        detail_cache.invalidate(task_db_id)
+        self.db.refresh(task)
+        return task
+
+    def claim_for_preparation(self, task_id: str) -> Optional[Task]:
+        """NONE -> PREPARING 并累加尝试次数：之后的去重、HEAD 等步骤失败都计入重试预算"""
+        return self._claim(
+            task_id, "NONE", "PREPARING",
+            task_id="",
+            submit_attempts=func.coalesce(Task.submit_attempts, 0) + 1,
+        )
+
+    def claim_for_submission(self, task_id: str) -> Optional[Task]:
+        """PREPARING -> SUBMITTING，紧接着调用听悟"""
+        return self._claim(task_id, "PREPARING", "SUBMITTING")
+
+    def get_stale_claimed(self, status: str, before: datetime):
+        """PREPARING / SUBMITTING 超过时限仍未落定的任务 (进程崩溃或被取消)"""
+        statement = select(Task).where(Task.status == status, Task.submitting_at < before)
+        return self.db.exec(statement).all()
+
+    def get_completed_by_content(self, size: int, etag: Optional[str] = None, content_hash: Optional[str] = None) -> Optional[Task]:
+        """按内容指纹 (size + ETag 或 hash) 查找已完成的任务"""
+        conditions = []
+        if etag:
+            conditions.append(Task.etag == etag)
+        if content_hash:
+            conditions.append(Task.content_hash == content_hash)
+        if not conditions:
+            return None
+        statement = select(Task).where(Task.status == "COMPLETED", Task.size == size, or_(*conditions))
+        return self.db.exec(statement).first()
+
+    def _status_changed(self, task: Task, previous: str) -> Optional[dict]:
+        """
+        生成状态变更事件；Postgres 下在当前事务里 NOTIFY，提交后才会投递给所有实例
+        """
+        if task.status == previous:
+            return None
+        event = {
+            "id": task.id,
+            "object_key": task.object_key,
+            "region": task.region,
+            "status": task.status,
+            "previous": previous,
+            "task_id": task.task_id,
+            "at": datetime.now(timezone.utc).isoformat(),
+        }
+        if IS_POSTGRES:
+            self.db.connection().execute(
+                text("SELECT pg_notify(:channel, :payload)"),
+                {"channel": events.PG_CHANNEL, "payload": json.dumps(event, ensure_ascii=False)},
+            )
+        return event
+
+    def _publish(self, event: Optional[dict]):
+        # Postgres 下由 LISTEN 转发，避免本实例收到两次
+        if event is not None and not IS_POSTGRES:
+            events.bus.publish(event)
+
     def update_task(self, db_obj: Task, **kwargs) -> Task:
         """通用更新函数"""
+        previous_status = db_obj.status
         for key, value in kwargs.items():
             # 保持原有的 JSON 序列化逻辑
             if key in ["query_res", "chapters", "summary", "transcripts"] and isinstance(value, (dict, list)):
@@ -112,9 +482,15 @@ class TaskCRUD:
             setattr(db_obj, key, value)
         
         db_obj.last_modified = datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+        if db_obj.status != previous_status:
+            db_obj.finished_at = datetime.now(timezone.utc) if db_obj.status in FINISHED_STATUSES else None
+        old_version = bump_version(db_obj)
         self.db.add(db_obj) # 显式 add 是好习惯，虽然修改对象通常会自动 track
+        event = self._status_changed(db_obj, previous_status)
         self.db.commit()
+        self._publish(event)
         self.db.refresh(db_obj)
+        detail_cache.invalidate(db_obj.id, old_version)
         return db_obj
     
 class UserCRUD:
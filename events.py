@@ -0,0 +1,96 @@
+import json
+import asyncio
+import logging
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+PG_CHANNEL = "task_status"
+
+
+class EventBus:
+    """
+    进程内的任务状态广播：worker/CRUD 在任意线程 publish，SSE 连接各自持有一个队列
+    多实例部署时由 Postgres LISTEN/NOTIFY 把事件转发到每个实例的 bus
+    """
+
+    def __init__(self, queue_size: int = 100):
+        self.queue_size = queue_size
+        self._subscribers: set[asyncio.Queue] = set()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._next_id = 0
+
+    def attach(self, loop: asyncio.AbstractEventLoop):
+        self._loop = loop
+
+    def subscribe(self) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self._subscribers.discard(queue)
+
+    def _dispatch(self, event: dict):
+        self._next_id += 1
+        event = {**event, "event_id": self._next_id}
+        for queue in list(self._subscribers):
+            if queue.full():
+                # 慢客户端丢最旧的事件，不阻塞其他连接
+                queue.get_nowait()
+            queue.put_nowait(event)
+
+    def publish(self, event: dict):
+        """线程安全；没有事件循环时 (脚本/CLI) 直接忽略"""
+        if self._loop is None or self._loop.is_closed():
+            return
+        self._loop.call_soon_threadsafe(self._dispatch, event)
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+
+bus = EventBus()
+
+
+async def listen_postgres(dsn: str):
+    """
+    LISTEN task_status，把其他实例 (包括自己) 的 NOTIFY 转发到本地 bus；断线后自动重连
+    """
+    import psycopg2
+    import psycopg2.extensions
+
+    loop = asyncio.get_running_loop()
+    while True:
+        conn = None
+        try:
+            conn = psycopg2.connect(dsn)
+            conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            with conn.cursor() as cur:
+                cur.execute(f"LISTEN {PG_CHANNEL};")
+            logger.info("[Events] Listening on Postgres channel task_status")
+
+            notified = asyncio.Event()
+            loop.add_reader(conn.fileno(), notified.set)
+            try:
+                while True:
+                    await notified.wait()
+                    notified.clear()
+                    conn.poll()
+                    while conn.notifies:
+                        notify = conn.notifies.pop(0)
+                        try:
+                            bus.publish(json.loads(notify.payload))
+                        except ValueError:
+                            logger.warning(f"[Events] Invalid payload: {notify.payload!r}")
+            finally:
+                loop.remove_reader(conn.fileno())
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"[Events] Postgres listener error: {e}, reconnecting")
+            await asyncio.sleep(5)
+        finally:
+            if conn is not None:
+                conn.close()
@@ -0,0 +1,157 @@
+"""
+批量导出已完成的会议 (NDJSON / Parquet)
+
+    python export.py --format ndjson --start 2025-01-01 --region cn-hongkong -o meetings.ndjson
+
+数据库端使用服务端游标 (yield_per) 分批读取，逐行产出，内存占用与总行数无关
+"""
+import sys
+import json
+import argparse
+from datetime import date, datetime, timezone
+from typing import Optional, Iterator
+
+from sqlmodel import Session, select
+
+from databacy import engine, to_utc_datetime, Task
+
+EXPORT_BATCH_SIZE = 200
+
+# 导出的列；四个 blob 字段在库里就是 JSON 字符串，原样拼进输出，不做 loads/dumps
+META_COLUMNS = ["id", "object_key", "region", "bucket", "size", "task_id", "recorded_at", "created_at"]
+BLOB_COLUMNS = ["query_res", "summary", "chapters", "transcripts"]
+
+
+def iter_completed_tasks(start: Optional[date] = None, end: Optional[date] = None, region: Optional[str] = None,
+                         batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[dict]:
+    """
+    逐行产出 COMPLETED 任务，按录制日期 [start, end) 和 region 过滤
+    只选需要的列 (不构造 ORM 对象)，配合 yield_per 走服务端游标
+    """
+    columns = [getattr(Task, name) for name in META_COLUMNS + BLOB_COLUMNS]
+    statement = select(*columns).where(Task.status == "COMPLETED")
+    if start is not None:
+        statement = statement.where(Task.recorded_at >= to_utc_datetime(start))
+    if end is not None:
+        statement = statement.where(Task.recorded_at < to_utc_datetime(end))
+    if region is not None:
+        statement = statement.where(Task.region == region)
+    statement = statement.order_by(Task.recorded_at, Task.id).execution_options(yield_per=batch_size)
+
+    with Session(engine) as db:
+        for row in db.exec(statement):
+            yield row._asdict()
+
+
+def _json_scalar(value) -> str:
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    return json.dumps(value, ensure_ascii=False)
+
+
+def iter_ndjson(rows: Iterator[dict]) -> Iterator[bytes]:
+    for row in rows:
+        parts = [f'"{name}": {_json_scalar(row[name])}' for name in META_COLUMNS]
+        parts += [f'"{name}": {row[name] or "{}"}' for name in BLOB_COLUMNS]
+        yield ("{" + ", ".join(parts) + "}\n").encode("utf-8")
+
+
+class _ChunkSink:
+    """给 ParquetWriter 用的类文件对象，写入的字节暂存，由生成器取走"""
+
+    def __init__(self):
+        self.chunks = []
+        self.closed = False
+        self.position = 0
+
+    def write(self, data):
+        data = bytes(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def iter_parquet(rows: Iterator[dict], batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[bytes]:
+    """每 batch_size 行写一个 row group 并立即产出，不在内存里攒完整文件"""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Parquet export requires pyarrow, please install it or use ndjson")
+
+    schema = pa.schema(
+        [("id", pa.string()), ("object_key", pa.string()), ("region", pa.string()), ("bucket", pa.string()),
+         ("size", pa.int64()), ("task_id", pa.string()),
+         ("recorded_at", pa.timestamp("us", tz="UTC")), ("created_at", pa.timestamp("us", tz="UTC"))]
+        + [(name, pa.string()) for name in BLOB_COLUMNS]
+    )
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression="zstd")
+
+    def write_batch(batch):
+        # SQLite 读出的时间不带时区，统一按 UTC 处理
+        for row in batch:
+            for name in ("recorded_at", "created_at"):
+                if row[name] is not None and row[name].tzinfo is None:
+                    row[name] = row[name].replace(tzinfo=timezone.utc)
+        writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            write_batch(batch)
+            batch = []
+            yield sink.drain()
+    if batch:
+        write_batch(batch)
+    writer.close()
+    yield sink.drain()
+
+
+def export_stream(fmt: str, start: Optional[date] = None, end: Optional[date] = None,
+                  region: Optional[str] = None) -> Iterator[bytes]:
+    rows = iter_completed_tasks(start=start, end=end, region=region)
+    match fmt:
+        case "ndjson":
+            return iter_ndjson(rows)
+        case "parquet":
+            return iter_parquet(rows)
+        case _:
+            raise ValueError(f"Unknown export format: {fmt!r}. Only 'ndjson' or 'parquet' are allowed.")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export COMPLETED meetings as NDJSON or Parquet")
+    parser.add_argument("--format", choices=["ndjson", "parquet"], default="ndjson")
+    parser.add_argument("--start", type=date.fromisoformat, help="recorded_at >= start (YYYY-MM-DD)")
+    parser.add_argument("--end", type=date.fromisoformat, help="recorded_at < end (YYYY-MM-DD)")
+    parser.add_argument("--region")
+    parser.add_argument("-o", "--output", help="output file, default stdout")
+    args = parser.parse_args(argv)
+
+    out = open(args.output, "wb") if args.output else sys.stdout.buffer
+    try:
+        for chunk in export_stream(args.format, start=args.start, end=args.end, region=args.region):
+            out.write(chunk)
+    finally:
+        if args.output:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,22 @@
+import sys
+import importlib.util
+
+
+def lazy_import(name: str):
+    """
+    延迟导入：返回一个占位模块，第一次访问属性时才真正执行导入
+    用于云 SDK (OSS / TOS / 听悟)、NumPy 这类导入很慢、但冷启动时用不到的依赖，
+    让第一个请求不必等它们加载；函数内的局部 import (httpx / passlib) 出于同样的原因
+    注意：name 的父包会被立即导入，应尽量传入顶层包
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f"No module named {name!r}", name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
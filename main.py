@@ -3,44 +3,185 @@ import os
 import asyncio
 import logging
 import json
-import httpx
+import time
+import threading
 
 from uuid import uuid4
-from datetime import datetime
+from datetime import datetime, date, timedelta, timezone
+from typing import Literal
 from contextlib import asynccontextmanager
 
 # [修改] 引入 run_in_threadpool 用於解決 async 函數中執行同步 DB 操作導致的卡死問題
 from fastapi.concurrency import run_in_threadpool
-from fastapi import FastAPI, UploadFile, File, HTTPException, Depends, status, Request, Response
+from fastapi import FastAPI, UploadFile, File, HTTPException, Depends, Query, status, Request, Response
+from fastapi.responses import RedirectResponse, StreamingResponse
+from fastapi.encoders import jsonable_encoder
 from fastapi.security import OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
-from passlib.context import CryptContext
+from functools import lru_cache
 from sqlmodel import Session, select
+from sqlalchemy.exc import IntegrityError
 
 # 导入自定义模块
-from databacy import init_db, get_db, engine, Task, TaskCRUD, User, UserCreate, UserRead
+from databacy import init_db, get_db, engine, bump_version, IS_POSTGRES, to_utc_datetime, Task, TaskCRUD, User, UserCreate, UserRead
+from cache import detail_cache
 import server  # 你的阿里云交互代码
 import aos
+import buckets
+import export
+import scheduler
+import events
+import audio
+from lazy import lazy_import
+from buckets import get_tos_config
 from auth import create_access_token, get_current_user
 
+analytics = lazy_import("analytics")
+
 # 配置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 # 环境变量
 IS_PRODUCTION = os.getenv("RENDER") is not None 
+WORKER_START_DELAY = float(os.getenv("WORKER_START_DELAY", 10))  # 没有请求时，启动后最多等多久再开 worker
+SUBMIT_MAX_ATTEMPTS = int(os.getenv("SUBMIT_MAX_ATTEMPTS", 3))      # 每个文件最多提交几次，超过进入死信
+SUBMIT_STALE_SECONDS = int(os.getenv("SUBMIT_STALE_SECONDS", 600))  # PREPARING / SUBMITTING 超过多久视为中断
+SUBMIT_BATCH_SIZE = int(os.getenv("SUBMIT_BATCH_SIZE", 10))         # 每轮最多提交几个，之后重新排序
+SUBMIT_CANDIDATES_PER_GROUP = 20                                     # 每个 (region, 请求人) 分组每轮参与公平排序的候选数
+SSE_HEARTBEAT_SECONDS = 15
+SUMMARY_CACHE_SECONDS = float(os.getenv("SUMMARY_CACHE_SECONDS", 5))  # 状态汇总的缓存时间
+SUMMARY_WINDOW_SECONDS = 3600                                         # 吞吐 / 失败率的统计窗口
+
+# 第一个请求成功返回后置位，后台 worker 等它再启动
+app_ready = asyncio.Event()
 
 # --- 辅助函数 ---
-def get_tos_config(region: str):
-    match region:
-        case "guangzhou":
-            return "yings-meeting", "tos-cn-guangzhou.volces.com"
-        case "hongkong":
-            return "bucket4hk", "tos-cn-hongkong.volces.com"
-        case _:
-            raise ValueError(f"Unknown region: {region}")
+def resolve_recorded_at(object_key: str, fallback: datetime | None = None):
+    """
+    录制日期只在入库时解析一次：优先文件名 -MMDDYY，失败时回退到 OSS 上传时间
+    """
+    recorded_at = aos.get_date(object_key)
+    if recorded_at is None:
+        logger.warning(f"Cannot parse recording date from key: {object_key}, fallback to {fallback}")
+        recorded_at = fallback
+    return recorded_at
+
+def backfill_buckets():
+    """
+    旧数据没有记录 bucket：按 region 补成该 region 的默认 bucket
+    必须在开始服务前完成，否则 /api/files 按 (region, bucket, key) 匹配不到旧记录，会重复入库
+    """
+    with Session(engine) as db:
+        crud = TaskCRUD(db)
+        for region in crud.get_regions_missing_bucket():
+            try:
+                entry = buckets.get_entry(region)
+            except ValueError:
+                logger.warning(f"Cannot resolve bucket for legacy tasks in region {region}")
+                continue
+            filled = crud.fill_missing_bucket(region, entry.bucket)
+            logger.info(f"Backfilled bucket {entry.bucket} for {filled} tasks in {region}")
+
+def backfill_tasks():
+    """为旧数据补齐 recorded_at (旧版本把解析结果以字符串写在 last_modified 里)，可以延后到 worker 里做"""
+    with Session(engine) as db:
+        crud = TaskCRUD(db)
+        missing = crud.get_tasks_missing_recorded_at()
+        filled = 0
+        for task in missing:
+            recorded_at = aos.get_date(task.object_key)
+            if recorded_at is not None:
+                # 不走 update_task，避免覆蓋 last_modified
+                task.recorded_at = recorded_at
+                bump_version(task)
+                db.add(task)
+                filled += 1
+        db.commit()
+    if missing:
+        logger.info(f"Backfilled recorded_at for {filled}/{len(missing)} tasks, the rest will use OSS upload time on next sync")
+
+# --- 下载相关 ---
+DOWNLOAD_URL_EXPIRES = 3600        # 预签名 URL 有效期 (秒)
+DOWNLOAD_CHUNK_SIZE = 256 * 1024   # proxy 模式每次读取的固定缓冲大小
+DOWNLOAD_URL_CACHE_MAX = 2048      # 最多缓存多少个预签名 URL
+
+_download_urls = {}     # (region, bucket, object_key) -> (url, expires_at)，按写入顺序排列
+_download_urls_lock = threading.Lock()
+
+def get_download_backend(region: str, bucket: str | None = None):
+    """
+    按 region / bucket 返回 (存储模块, 同步客户端, bucket)，客户端由 buckets 的客户端池复用
+    未登记的 region 由 get_tos_config 决定；同一 region 登记了多个 bucket 时必须指定 bucket
+    """
+    if bucket is None and len(buckets.region_entries(region)) > 1:
+        raise HTTPException(status_code=409, detail=f"Region {region} has several buckets, specify bucket")
+    entry = buckets.get_entry(region, bucket)
+    return buckets.storage_module(entry), buckets.get_client(entry, "sign"), entry.bucket
+
+def get_cached_download_url(region: str, object_key: str, bucket: str | None = None):
+    """
+    返回 (url, 剩余有效秒数)；在过期前一半时间内复用同一个 URL，浏览器缓存才能命中
+    """
+    now = time.monotonic()
+    cached = _download_urls.get((region, bucket, object_key))
+    if cached and cached[1] - now > DOWNLOAD_URL_EXPIRES / 2:
+        return cached[0], int(cached[1] - now)
+
+    module, client, bucket_name = get_download_backend(region, bucket)
+    url = module.get_object_url(client, object_key, bucket=bucket_name, expires=DOWNLOAD_URL_EXPIRES)
+    if url == 'Invalid url':
+        raise HTTPException(status_code=502, detail="Failed to presign download url")
+    with _download_urls_lock:
+        _download_urls.pop((region, bucket, object_key), None)
+        if len(_download_urls) >= DOWNLOAD_URL_CACHE_MAX:
+            # 先清掉已过期的；仍然太多就丢最早写入的
+            for key in [key for key, (_, expires_at) in _download_urls.items() if expires_at <= now]:
+                del _download_urls[key]
+            while len(_download_urls) >= DOWNLOAD_URL_CACHE_MAX:
+                del _download_urls[next(iter(_download_urls))]
+        _download_urls[(region, bucket, object_key)] = (url, now + DOWNLOAD_URL_EXPIRES)
+    return url, DOWNLOAD_URL_EXPIRES
+
+def parse_range_header(range_header: str | None, size: int):
+    """
+    解析单段 Range: bytes=start-end / bytes=start- / bytes=-suffix
+    无 Range、格式不合法或多段时返回 None (按 RFC 7233 忽略，返回完整内容)；
+    格式合法但无法满足时抛 416
+    """
+    if not range_header:
+        return None
+
+    unit, _, spec = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+
+    start_str, sep, end_str = spec.strip().partition("-")
+    start_str, end_str = start_str.strip(), end_str.strip()
+    if not sep or not (start_str or end_str):
+        return None
+    if (start_str and not start_str.isdigit()) or (end_str and not end_str.isdigit()):
+        return None
+
+    if start_str == "":
+        # 后缀形式：最后 N 个字节
+        length = int(end_str)
+        start, end = max(size - length, 0), size - 1
+        if length == 0:
+            start = size
+    else:
+        start = int(start_str)
+        if end_str and int(end_str) < start:
+            return None
+        end = int(end_str) if end_str else size - 1
+
+    end = min(end, size - 1)
+    if start > end or start >= size:
+        raise HTTPException(status_code=416, detail="Range not satisfiable", headers={"Content-Range": f"bytes */{size}"})
+    return start, end
         
 async def jsonize_stt_url(url):
+    import httpx
     try:
         async with httpx.AsyncClient() as client:
             response = await client.get(url)
@@ -55,54 +196,217 @@ async def jsonize_stt_url(url):
 
 # --- [修改] 核心：后台处理逻辑 (重构以避免死锁) ---
 
+# 结果去重统计：命中时直接复用已完成的转写，不再提交听悟
+dedup_stats = {"hits": 0, "misses": 0}
+
+def link_cached_result(task_db_id: str, size: int, etag: str | None, content_hash: str | None) -> bool:
+    """
+    按内容指纹查找已完成的任务，命中则把结果复制到当前 Task 并标记 COMPLETED
+    """
+    with Session(engine) as db:
+        crud = TaskCRUD(db)
+        source = crud.get_completed_by_content(size, etag=etag, content_hash=content_hash)
+        if source is None:
+            return False
+        current_task = crud.get_task(task_db_id)
+        if current_task is None or current_task.status != "PREPARING":
+            return False
+        crud.update_task(
+            current_task,
+            status="COMPLETED",
+            task_id=source.task_id,
+            query_res=source.query_res,
+            chapters=source.chapters,
+            summary=source.summary,
+            transcripts=source.transcripts,
+            dedup_of=source.id,
+        )
+        return True
+
+def record_submit_failure(crud: TaskCRUD, task: Task, error: str):
+    """失敗時記錄 last_error；超過重試預算進入死信 (DEAD)，不再自動重試"""
+    attempts = task.submit_attempts or 0
+    if attempts >= SUBMIT_MAX_ATTEMPTS:
+        crud.update_task(task, status="DEAD", last_error=error)
+        logger.error(f"[Submit] {task.object_key} dead-lettered after {attempts} attempts: {error}")
+    else:
+        crud.update_task(task, status="NONE", last_error=error)
+        logger.warning(f"[Submit] {task.object_key} attempt {attempts}/{SUBMIT_MAX_ATTEMPTS} failed: {error}")
+
+def claim_for_preparation(task_db_id: str) -> bool:
+    with Session(engine) as db:
+        return TaskCRUD(db).claim_for_preparation(task_db_id) is not None
+
+def record_prepare_failure(task_db_id: str, error: str):
+    """認領後、提交前的步驟 (HEAD / 去重 / 查 bucket) 出錯，同樣計入重試預算"""
+    with Session(engine) as db:
+        crud = TaskCRUD(db)
+        task = crud.get_task(task_db_id)
+        if task is not None and task.status == "PREPARING":
+            record_submit_failure(crud, task, error)
+
+def submit_and_record(task_db_id: str, entry):
+    """
+    PREPARING -> SUBMITTING -> 提交聽悟 -> 寫入 ONGOING，全部在同一個線程裡完成
+    返回 None 表示任務已不在 PREPARING (被對賬處理或其他 worker 改動)
+    """
+    with Session(engine) as db:
+        crud = TaskCRUD(db)
+        task = crud.claim_for_submission(task_db_id)
+        if task is None:
+            return None
+
+        # 每行固定一個 task_key，任何一次嘗試在聽悟側的任務都能按它對回本地記錄
+        submit_key = task.submit_key or task.id
+        if task.submit_key != submit_key:
+            crud.update_task(task, submit_key=submit_key)
+        try:
+            # 各 region 用各自的提交 endpoint (內網 / 最近的公網入口) 生成鏈接；有音頻衍生文件時提交音頻
+            file_url = buckets.get_submit_url(entry, task.audio_key or task.object_key)
+        except Exception as e:
+            # 還沒調用聽悟，可以安全重試
+            record_submit_failure(crud, task, str(e))
+            return False
+
+        try:
+            res = server.submit_task(None, task.object_key, file_url, submit_key=submit_key)
+        except Exception as e:
+            # submit_task 自己兜住了發送請求時的異常，這裡拋出的只會是請求發出前的錯誤 (憑證 / 構造參數)
+            res = {"task_id": "", "status": "ERROR", "error": str(e)}
+
+        if res and res.get("task_id"):
+            scheduler.submit_metrics.observe(task.priority, task.queued_at or task.created_at)
+            crud.update_task(task, status="ONGOING", task_id=res["task_id"], last_error=None)
+            logger.info(f"[Submit] Submitted {task.object_key}, Task ID: {res['task_id']}")
+            return True
+
+        error = str((res or {}).get("error") or res)
+        if res.get("ambiguous"):
+            # 超時 / 斷線：聽悟可能已受理，不自動重提
+            orphan_submission(crud, task, error)
+        else:
+            record_submit_failure(crud, task, error)
+        return False
+
+def orphan_submission(crud: TaskCRUD, task: Task, error: str):
+    """不確定聽悟是否已受理：轉入 ORPHANED，運維按 submit_key 核對後通過 /api/tasks/{id}/retry 重新入隊"""
+    error = f"{error}; check Tingwu for task_key={task.submit_key} before retrying"
+    crud.update_task(task, status="ORPHANED", last_error=error)
+    logger.error(f"[Submit] {task.object_key} orphaned: {error}")
+
+def reconcile_submissions():
+    """
+    處理卡住的認領 (進程崩潰或被取消時沒來得及落庫)
+    PREPARING: 還沒調用聽悟，計入重試預算後放回 NONE 或進死信
+    SUBMITTING: 聽悟 SDK 無法按 task_key 查詢任務，不確定是否已受理，所以不自動重提 (避免重複計費)，轉入 ORPHANED
+    """
+    now = datetime.now(timezone.utc)
+    before = now - timedelta(seconds=SUBMIT_STALE_SECONDS)
+    # PREPARING 可能在轉碼，時限要覆蓋 ffmpeg 的最長運行時間
+    prepare_before = before - timedelta(seconds=audio.AUDIO_TIMEOUT) if audio.enabled() else before
+    with Session(engine) as db:
+        crud = TaskCRUD(db)
+        for task in crud.get_stale_claimed("PREPARING", prepare_before):
+            record_submit_failure(crud, task, "interrupted while preparing submission")
+        for task in crud.get_stale_claimed("SUBMITTING", before):
+            orphan_submission(crud, task, "interrupted during submission")
+
+# 正在轉碼的後台任務 (每個都持有一條 PREPARING 記錄)
+_audio_jobs: set[asyncio.Task] = set()
+
+async def extract_and_submit(task_db_id: str, entry):
+    """PREPARING 狀態下抽取音軌 (失敗時提交原文件)，然後提交聽悟"""
+    try:
+        await asyncio.to_thread(audio.prepare_audio, task_db_id, entry)
+        await asyncio.to_thread(submit_and_record, task_db_id, entry)
+    except Exception as e:
+        logger.error(f"[Audio] Error preparing {task_db_id}: {e}")
+        await asyncio.to_thread(record_prepare_failure, task_db_id, str(e))
+
 async def process_submission():
     """
     阶段 1: 查找 status='NONE' 的记录 -> 构造URL -> 提交给阿里云 -> 更新为 'ONGOING'
     [修改] 不再接收 db 參數，而是內部自行管理 Session，避免長時間佔用連接
     """
     tasks_to_process = []
+
+    # 先對賬：上次崩潰/取消時卡在 PREPARING / SUBMITTING 的任務
+    await asyncio.to_thread(reconcile_submissions)
     
     # 1. 快速獲取任務 (同步操作，放入線程池或快速執行)
     # 這裡使用 with Session 確保用完即關
     with Session(engine) as db:
         crud = TaskCRUD(db)
-        pending_tasks = crud.get_tasks_by_status("NONE")
+        pending_tasks = crud.get_pending_for_submission(per_group=SUBMIT_CANDIDATES_PER_GROUP)
         # 提取需要的數據，脫離 Session 範圍
-        tasks_to_process = [{"id": t.id, "object_key": t.object_key} for t in pending_tasks]
+        tasks_to_process = [
+            {"id": t.id, "object_key": t.object_key, "region": t.region, "bucket": t.bucket,
+             "size": t.size, "etag": t.etag, "content_hash": t.content_hash, "audio_key": t.audio_key,
+             "priority": t.priority, "requested_by": t.requested_by}
+            for t in pending_tasks
+        ]
     
     if not tasks_to_process:
         return
 
-    client = aos.init_client(is_async=False, endpoint='custom')
+    # 優先級分層 + 按 region / 請求人輪轉；每輪只提交一小批，新加急的任務下一輪就能排到前面
+    tasks_to_process = scheduler.fair_order(tasks_to_process)[:SUBMIT_BATCH_SIZE]
+
     total = len(tasks_to_process)
     
     for index, task_info in enumerate(tasks_to_process):
         object_key = task_info["object_key"]
         task_db_id = task_info["id"]
-        
+
+        # 需要抽音軌的任務只在有空閒轉碼槽位時才認領，否則留在 NONE 等下一輪
+        needs_audio = audio.enabled() and not task_info["audio_key"] and audio.should_extract(object_key, task_info["size"])
+        if needs_audio and len(_audio_jobs) >= audio.AUDIO_CONCURRENCY:
+            continue
+
+        # 先認領 (NONE -> PREPARING 並計一次嘗試)，之後任何一步出錯都走重試預算，不會每輪無限重來
+        if not await asyncio.to_thread(claim_for_preparation, task_db_id):
+            continue
+
         try:
+            entry = buckets.get_entry(task_info["region"], task_info["bucket"])
+            # 0. 相同內容已轉寫過：直接複用結果，跳過聽悟
+            if await asyncio.to_thread(link_cached_result, task_db_id, task_info["size"], task_info["etag"], task_info["content_hash"]):
+                dedup_stats["hits"] += 1
+                logger.info(f"[Submit] Reused cached result for {object_key} ({dedup_stats})")
+                continue
+
+            # ETag 與分片方式有關，未命中時再用 CRC64 比對一次
+            if not task_info["content_hash"]:
+                content_hash = await asyncio.to_thread(
+                    buckets.storage_module(entry).get_object_hash, buckets.get_client(entry, "sign"), object_key, bucket=entry.bucket
+                )
+                if content_hash:
+                    with Session(engine) as db:
+                        crud = TaskCRUD(db)
+                        current_task = crud.get_task(task_db_id)
+                        if current_task:
+                            crud.update_task(current_task, content_hash=content_hash)
+                    if await asyncio.to_thread(link_cached_result, task_db_id, task_info["size"], None, content_hash):
+                        dedup_stats["hits"] += 1
+                        logger.info(f"[Submit] Reused cached result for {object_key} ({dedup_stats})")
+                        continue
+
+            dedup_stats["misses"] += 1
             logger.info(f"[Submit] Processing {index + 1}/{total}: {object_key}")
-            # [修改] 網絡請求是耗時操作，確保不持有 DB 鎖
-            res = await asyncio.to_thread(server.submit_task, client, object_key)
-            
-            # 2. 更新數據庫 (重新建立短連接)
-            if res and res.get("task_id"):
-                with Session(engine) as db:
-                    crud = TaskCRUD(db)
-                    # 重新獲取對象以附加到當前 Session
-                    current_task = crud.get_task_by_key(object_key)
-                    if current_task:
-                        crud.update_task(
-                            current_task, 
-                            status="ONGOING", 
-                            task_id=res["task_id"]
-                        )
-                logger.info(f"[Submit] Submitted {object_key}, Task ID: {res['task_id']}")
-            else:
-                logger.error(f"[Submit] Failed to submit {object_key}: {res}")
+            # 抽音軌耗時長：交給後台任務，轉碼完成後再提交，不阻塞本輪其他任務和輪詢
+            if needs_audio:
+                job = asyncio.create_task(extract_and_submit(task_db_id, entry))
+                _audio_jobs.add(job)
+                job.add_done_callback(_audio_jobs.discard)
+                continue
+            # [修改] 提交和落庫放在同一個線程函數裡：worker 被 cancel 時線程仍會跑完並寫入 ONGOING
+            outcome = await asyncio.to_thread(submit_and_record, task_db_id, entry)
+            if outcome is None:
+                continue
                 
         except Exception as e:
             logger.error(f"[Submit] Error processing {object_key}: {e}")
+            await asyncio.to_thread(record_prepare_failure, task_db_id, str(e))
         
         # 避免請求過於頻繁
         await asyncio.sleep(1)
@@ -153,15 +457,21 @@ async def process_polling():
                 # 寫回數據庫
                 with Session(engine) as db:
                     crud = TaskCRUD(db)
-                    task_record = crud.get_task_by_key(object_key)
+                    task_record = crud.get_task(db_id)
                     if task_record:
                         crud.update_task(task_record, status="COMPLETED", query_res=result_dict, chapters=chapters, summary=summary, transcripts=transcripts)
                 logger.info(f"[Poll] Task {object_key} COMPLETED.")
+
+                # 完成時計算一次會議統計，失敗不影響任務狀態 (worker 會補算)
+                try:
+                    await asyncio.to_thread(analytics.materialize_for_task, db_id)
+                except Exception as e:
+                    logger.error(f"[Analytics] Error computing stats for {object_key}: {e}")
                 
             elif remote_status == "FAILED":
                 with Session(engine) as db:
                     crud = TaskCRUD(db)
-                    task_record = crud.get_task_by_key(object_key)
+                    task_record = crud.get_task(db_id)
                     if task_record:
                         crud.update_task(task_record, status="FAILED", query_res={"error": "AliCloud Task Failed"})
                 logger.error(f"[Poll] Task {object_key} FAILED remotely.")
@@ -172,12 +482,20 @@ async def process_polling():
 
 async def background_worker():
     """后台主循环"""
+    # 冷啟動時先把資源讓給第一個請求：收到就緒信號 (或等待超時) 後才開始幹活
+    try:
+        await asyncio.wait_for(app_ready.wait(), timeout=WORKER_START_DELAY)
+    except asyncio.TimeoutError:
+        pass
+    await asyncio.to_thread(backfill_tasks)
     logger.info("Background worker started.")
     while True:
         try:
             # [修改] 不要在這裡開啟全局 Session
             await process_submission()
             await process_polling()
+            # 補算歷史任務 / 去重複用結果的統計，每輪只做一小批
+            await asyncio.to_thread(analytics.materialize_pending)
         except Exception as e:
             logger.error(f"Critical error in background worker: {e}")
         
@@ -186,21 +504,58 @@ async def background_worker():
 
 
 # --- Authorization ---
-pwd_context = CryptContext(schemes=["argon2"], deprecated="auto")
+@lru_cache
+def get_pwd_context():
+    from passlib.context import CryptContext
+    return CryptContext(schemes=["argon2"], deprecated="auto")
 
 # --- FastAPI App ---
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # 启动初始化
-    init_db()
+    # 启动初始化：schema 未变化时 init_db 只做一次轻量查询
+    await asyncio.to_thread(init_db)
+    await asyncio.to_thread(backfill_buckets)
+    # 状态推送：进程内广播；多实例 (Postgres) 时通过 LISTEN/NOTIFY 互通
+    events.bus.attach(asyncio.get_running_loop())
+    listener_task = None
+    if IS_POSTGRES:
+        # psycopg2 不認 postgresql+psycopg2:// 這類 SQLAlchemy 方言前綴
+        dsn = engine.url.set(drivername="postgresql").render_as_string(hide_password=False)
+        listener_task = asyncio.create_task(events.listen_postgres(dsn))
     worker_task = asyncio.create_task(background_worker())
     yield
     # 关闭清理
     worker_task.cancel()
+    for job in list(_audio_jobs):
+        job.cancel()
+    if listener_task:
+        listener_task.cancel()
 
 app = FastAPI(lifespan=lifespan)
 
+class ReadyMiddleware:
+    """
+    第一個狀態碼 < 500 的響應發出時置位 app_ready
+    純 ASGI 實現：置位後直接透傳，不包裝下載流 / SSE 等響應體
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if app_ready.is_set() or scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start" and message["status"] < 500:
+                app_ready.set()
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+app.add_middleware(ReadyMiddleware)
+
 # --- CORS ---
 app.add_middleware(
     CORSMiddleware,
@@ -223,7 +578,7 @@ def login_for_access_token(response: Response, form_data: OAuth2PasswordRequestF
     statement = select(User).where(User.agent_code == form_data.username)
     user = session.exec(statement).first()
 
-    if not user or not pwd_context.verify(form_data.password, user.hashed_password):
+    if not user or not get_pwd_context().verify(form_data.password, user.hashed_password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
@@ -255,7 +610,7 @@ def create_user(user_create: UserCreate, session: Session = Depends(get_db)):
     existing_user = session.exec(select(User).where(User.agent_code == user_create.agent_code)).first()
     if existing_user:
         raise HTTPException(status_code=400, detail="Code replicated")
-    hashed_password = pwd_context.hash(user_create.password)
+    hashed_password = get_pwd_context().hash(user_create.password)
     db_user = User.model_validate(user_create, update={"hashed_password": hashed_password})
     session.add(db_user)
     session.commit()
@@ -267,40 +622,67 @@ def create_user(user_create: UserCreate, session: Session = Depends(get_db)):
 # [修改] 保持 async def，因為用到了 await aos...
 # 但必須使用 run_in_threadpool 處理同步 DB 邏輯
 @app.get("/api/files")
-async def get_files(db: Session = Depends(get_db)):
-    """同步 OSS 文件列表到数据库"""
-    client = aos.init_client()
+async def get_files(start: date | None = None, end: date | None = None, db: Session = Depends(get_db)):
+    """
+    同步 OSS 文件列表到数据库
+    start / end: 按录制日期筛选 [start, end)，结果按录制日期倒序
+    """
     try:
-        # 1. 異步獲取文件列表 (不會阻塞)
-        dates, contents = await aos.get_all_files(client,'yaps-meeting')
+        # 1. 並發列舉所有登記的 bucket，總耗時取決於最慢的那個
+        listed = await buckets.list_all_buckets()
         
         # 2. 定義同步的 DB 更新邏輯
         def sync_db_logic():
             crud = TaskCRUD(db)
-            for index, item in enumerate(contents):
-                key_start = item.key.find('/') + 1
-                key = item.key[key_start:] if key_start != -1 else item.key
-                
-                record = crud.get_task_by_key(key)
-                
-                if record is None:
-                    new_task = {
-                        "id": str(uuid4()),
-                        "object_key": key,
-                        "region": 'cn-hongkong',
-                        "size": item.size,
-                        "last_modified": dates[index],
-                        "status": "NONE"
-                    }
-                    crud.create_task(new_task)
-                    logger.info(f"Synced new file: {key}")
-                else:
-                    crud.update_task(
-                        record, 
-                        size=item.size, 
-                        last_modified=dates[index]
-                    )
-            return db.exec(select(Task)).all()
+            for entry, contents in listed:
+                for item in contents:
+                    key_start = item.key.find('/') + 1
+                    key = item.key[key_start:] if key_start != -1 else item.key
+                    if audio.is_audio_key(key):
+                        continue
+                    etag = item.etag.strip('"') if item.etag else None
+                    # TOS 列舉結果直接帶 CRC64，OSS 需要在提交前 HEAD
+                    crc64 = getattr(item, "hash_crc64_ecma", None)
+                    content_hash = f"crc64:{crc64}" if crc64 else None
+                    
+                    record = crud.get_task_by_location(entry.region, entry.bucket, key)
+                    
+                    if record is None:
+                        new_task = {
+                            "id": str(uuid4()),
+                            "object_key": key,
+                            "region": entry.region,
+                            "bucket": entry.bucket,
+                            "size": item.size,
+                            "recorded_at": resolve_recorded_at(key, item.last_modified),
+                            "etag": etag,
+                            "content_hash": content_hash,
+                            "status": "NONE"
+                        }
+                        try:
+                            crud.create_task(new_task)
+                        except IntegrityError:
+                            # 並發的同步請求已經插入了同一個位置 (唯一索引)
+                            db.rollback()
+                            continue
+                        logger.info(f"Synced new file: {entry.region}/{entry.bucket}/{key}")
+                    else:
+                        # 只有真的變了才寫庫，避免每次列表都逐行 commit
+                        changes = {}
+                        if record.size != item.size:
+                            changes["size"] = item.size
+                        if etag and record.etag != etag:
+                            changes["etag"] = etag
+                        if content_hash and record.content_hash != content_hash:
+                            changes["content_hash"] = content_hash
+                        if record.audio_key and ("size" in changes or "etag" in changes):
+                            # 原文件被覆蓋，舊的音頻衍生文件作廢，下次提交時重新抽取
+                            changes.update(audio_key=None, audio_size=None)
+                        if record.recorded_at is None:
+                            changes["recorded_at"] = resolve_recorded_at(key, item.last_modified)
+                        if changes:
+                            crud.update_task(record, **changes)
+            return crud.list_tasks(start=to_utc_datetime(start), end=to_utc_datetime(end))
 
         # 3. [關鍵修改] 在線程池中運行同步 DB 邏輯
         all_records = await run_in_threadpool(sync_db_logic)
@@ -309,57 +691,289 @@ async def get_files(db: Session = Depends(get_db)):
     except Exception as e:
         logger.error(f"Error syncing files: {e}")
         return []
-    finally:
-        await client.close()
+
+@app.post("/api/tasks/{task_db_id}/retry")
+def retry_task(task_db_id: str, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    """
+    把死信 (DEAD)、失敗或中斷 (ORPHANED) 的任務放回隊列，重置重試次數
+    ORPHANED 的任務請先按 submit_key 確認聽悟側沒有已受理的任務
+    """
+    crud = TaskCRUD(db)
+    task = crud.get_task(task_db_id)
+    if task is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+    if task.status not in ("DEAD", "FAILED", "ORPHANED"):
+        raise HTTPException(status_code=409, detail=f"Task is {task.status}, only DEAD, FAILED or ORPHANED tasks can be retried")
+    return crud.update_task(task, status="NONE", task_id="", submit_attempts=0, last_error=None)
+
+@app.post("/api/tasks/{task_db_id}/priority")
+def bump_priority(task_db_id: str, priority: int = Query(scheduler.URGENT_PRIORITY, ge=1, le=scheduler.URGENT_PRIORITY),
+                  db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    """
+    按需加急：提升待提交任務的優先級，下一輪調度即排到前面
+    priority 最高為 URGENT_PRIORITY，只能調高不能調低 (不能插到其他加急請求前面，也不能撤銷別人的加急)
+    """
+    crud = TaskCRUD(db)
+    task = crud.get_task(task_db_id)
+    if task is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+    if task.status != "NONE":
+        raise HTTPException(status_code=409, detail=f"Task is {task.status}, only pending tasks can be prioritized")
+    if priority <= (task.priority or 0):
+        return task
+    return crud.update_task(
+        task,
+        priority=priority,
+        requested_by=current_user.agent_code,
+        queued_at=datetime.now(timezone.utc),
+    )
+
+@app.get("/api/scheduler/stats")
+async def get_scheduler_stats():
+    return scheduler.submit_metrics.stats()
+
+@app.get("/api/dedup/stats")
+async def get_dedup_stats():
+    total = dedup_stats["hits"] + dedup_stats["misses"]
+    return {**dedup_stats, "hit_rate": dedup_stats["hits"] / total if total else 0.0}
+
+_summary_cache = {"payload": None, "expires_at": 0.0}
+_summary_lock = asyncio.Lock()
+
+def build_task_summary():
+    now = datetime.now(timezone.utc)
+    with Session(engine) as db:
+        raw = TaskCRUD(db).get_status_summary(since=now - timedelta(seconds=SUMMARY_WINDOW_SECONDS))
+
+    by_status, by_region = {}, {}
+    for task_status, region, count in raw["counts"]:
+        by_status[task_status] = by_status.get(task_status, 0) + count
+        by_region.setdefault(region, {})[task_status] = count
+
+    oldest_pending = raw["oldest_pending"]
+    if oldest_pending is not None and oldest_pending.tzinfo is None:
+        oldest_pending = oldest_pending.replace(tzinfo=timezone.utc)
+
+    finished = raw["finished"]
+    failed = finished.get("FAILED", 0) + finished.get("DEAD", 0) + finished.get("ORPHANED", 0)
+    finished_total = failed + finished.get("COMPLETED", 0)
+    return {
+        "total": sum(by_status.values()),
+        "by_status": by_status,
+        "by_region": by_region,
+        "backlog": sum(by_status.get(s, 0) for s in ("NONE", "PREPARING", "SUBMITTING")),
+        "oldest_pending_seconds": (now - oldest_pending).total_seconds() if oldest_pending else None,
+        "window_seconds": SUMMARY_WINDOW_SECONDS,
+        "finished_in_window": finished,
+        "throughput_per_hour": finished.get("COMPLETED", 0) * 3600 / SUMMARY_WINDOW_SECONDS,
+        "failure_rate": failed / finished_total if finished_total else 0.0,
+        "generated_at": now,
+    }
+
+@app.get("/api/tasks/summary")
+async def get_task_summary():
+    """
+    积压 / 失败率汇总，供仪表盘和健康检查高频轮询
+    只跑几条聚合查询，不读 blob 列也不访问 OSS；结果缓存几秒，并发的未命中只查一次库
+    """
+    if time.monotonic() >= _summary_cache["expires_at"]:
+        async with _summary_lock:
+            if time.monotonic() >= _summary_cache["expires_at"]:
+                _summary_cache["payload"] = await asyncio.to_thread(build_task_summary)
+                _summary_cache["expires_at"] = time.monotonic() + SUMMARY_CACHE_SECONDS
+    return _summary_cache["payload"]
 
 @app.post("/api/upload/{region}")
 async def upload_file(region: str, file: UploadFile = File(...), db: Session = Depends(get_db)):
     return {"status":"function not ready yet"}
     
-@app.get("/api/download/{region}/{object_key}")
-async def download_file(region:str, object_key: str):
-    return
+@app.get("/api/download/{region}/{object_key:path}")
+async def download_file(region: str, object_key: str, request: Request, bucket: str | None = None,
+                        mode: Literal["redirect", "proxy"] = "redirect", current_user: User = Depends(get_current_user)):
+    """
+    redirect (默认): 302 到预签名 CDN URL，并带上 Cache-Control 让浏览器复用
+    proxy: 由服务端按 Range 分块转发，拖动进度条时只拉取需要的字节
+    bucket: 同一 region 登记了多个 bucket 时必填 (详情接口返回的 bucket 字段)
+    """
+    try:
+        module, client, bucket_name = await asyncio.to_thread(get_download_backend, region, bucket)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+    if mode == "redirect":
+        url, max_age = await asyncio.to_thread(get_cached_download_url, region, object_key, bucket)
+        return RedirectResponse(url, status_code=302, headers={"Cache-Control": f"private, max-age={max_age // 2}"})
+
+    try:
+        size, content_type, etag = await asyncio.to_thread(module.head_object, client, object_key, bucket=bucket_name)
+    except Exception as e:
+        logger.error(f"[Download] Error reading {region}/{object_key}: {e}")
+        raise HTTPException(status_code=404, detail="Object not found")
+
+    if size == 0:
+        return Response(content=b"", media_type=content_type or "application/octet-stream")
+
+    byte_range = parse_range_header(request.headers.get("range"), size)
+    start, end = byte_range if byte_range else (0, size - 1)
+    headers = {
+        "Accept-Ranges": "bytes",
+        "Content-Length": str(end - start + 1),
+    }
+    if etag:
+        headers["ETag"] = etag
+    if byte_range:
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+
+    # 同步生成器会被 StreamingResponse 放入線程池迭代，不阻塞 Event Loop
+    body = module.iter_object(client, object_key, start, end, bucket=bucket_name, chunk_size=DOWNLOAD_CHUNK_SIZE)
+    return StreamingResponse(
+        body,
+        status_code=206 if byte_range else 200,
+        media_type=content_type or "application/octet-stream",
+        headers=headers,
+    )
 
 # [修改] 解決 async def 混用同步 DB 查詢的問題
 @app.get("/api/meetings/detail")
-async def file_detail(object_key: str, db: Session = Depends(get_db)):
-    print(f"getting {object_key}")
+async def file_detail(object_key: str | None = None, task_db_id: str | None = None, region: str | None = None,
+                      bucket: str | None = None, db: Session = Depends(get_db)):
+    """
+    按 task_db_id 或 (region, bucket, object_key) 定位會議；只傳 object_key 時要求它在所有 bucket 中唯一
+    """
+    if task_db_id is None and object_key is None:
+        raise HTTPException(status_code=422, detail="object_key or task_db_id is required")
+    print(f"getting {task_db_id or object_key}")
     
-    # 1. [關鍵修改] 使用線程池執行同步查詢
-    def get_task_sync():
+    # 1. [關鍵修改] 使用線程池執行同步查詢，只取 id / version，不讀 blob
+    def get_ref_sync():
         crud = TaskCRUD(db)
-        return crud.get_task_by_key(object_key)
+        return crud.get_task_refs(task_db_id=task_db_id, object_key=object_key, region=region, bucket=bucket)
     
-    db_task = await run_in_threadpool(get_task_sync)
+    refs = await run_in_threadpool(get_ref_sync)
     
-    if db_task is None:
+    if not refs:
         raise HTTPException(status_code=404, detail="Subtitle not found")
+    if len(refs) > 1:
+        raise HTTPException(status_code=409, detail="object_key matches several meetings, specify task_db_id (or region and bucket)")
     
-    client = aos.init_client(is_async=False, endpoint='custom')
-
+    task_db_id, version, region, bucket, object_key = refs[0]
+    version = version or 0
+
+    # 2. 讀穿緩存：未命中才讀整行並解析 JSON，結果以序列化後的 bytes 緩存
+    payload = await run_in_threadpool(detail_cache.get, task_db_id, version)
+    if payload is None:
+        def build_payload_sync():
+            db_task = TaskCRUD(db).get_task(task_db_id)
+            if db_task is None:
+                return None
+            result = {
+                "id": db_task.id,
+                "object_key": db_task.object_key,
+                "region": db_task.region,
+                "bucket": db_task.bucket,
+                "size": db_task.size,
+                "audio_key": db_task.audio_key,
+                "audio_size": db_task.audio_size,
+                "task_id": db_task.task_id,
+                "status": db_task.status,
+                "query_res": json.loads(db_task.query_res) if db_task.query_res else {},
+                "summary": json.loads(db_task.summary) if db_task.summary else {},
+                "chapters": json.loads(db_task.chapters) if db_task.chapters else {},
+                "transcripts": json.loads(db_task.transcripts) if db_task.transcripts else {},
+                "created_at": db_task.created_at,
+                "last_modified": db_task.last_modified,
+                "recorded_at": db_task.recorded_at,
+            }
+            return json.dumps(jsonable_encoder(result), ensure_ascii=False).encode("utf-8")
+
+        payload = await run_in_threadpool(build_payload_sync)
+        if payload is None:
+            raise HTTPException(status_code=404, detail="Subtitle not found")
+        await run_in_threadpool(detail_cache.set, task_db_id, version, payload)
+
+    # 3. 預覽鏈接有時效，不進緩存，按 region / bucket 單獨複用
     try:
-        # 獲取 URL 本身如果是同步的，也建議用 to_thread，或者如果 client 是異步的則 await
-        url = await asyncio.to_thread(aos.get_object_url, client, object_key)
+        url, _ = await asyncio.to_thread(get_cached_download_url, region, object_key, bucket)
+    except HTTPException:
+        url = 'Invalid url'
     except Exception as e:
         raise HTTPException(500, f"Error getting url: {e}")
 
-    result = {
-        "id": db_task.id,
-        "object_key": db_task.object_key,
-        "region": db_task.region,
-        "size": db_task.size,
-        "task_id": db_task.task_id,
-        "status": db_task.status,
-        "query_res": json.loads(db_task.query_res) if db_task.query_res else {},
-        "summary": json.loads(db_task.summary) if db_task.summary else {},
-        "chapters": json.loads(db_task.chapters) if db_task.chapters else {},
-        "transcripts": json.loads(db_task.transcripts) if db_task.transcripts else {},
-        "url":url,
-        "created_at": db_task.created_at,
-        "last_modified": db_task.last_modified,
-    }
-    
-    return result
+    # 直接把 url 拼到已序列化的 JSON 末尾，避免重新編碼整份轉寫
+    body = payload[:-1] + b', "url": ' + json.dumps(url).encode("utf-8") + b'}'
+    return Response(content=body, media_type="application/json")
+
+@app.get("/api/export")
+async def export_meetings(
+    format: Literal["ndjson", "parquet"] = "ndjson",
+    start: date | None = None,
+    end: date | None = None,
+    region: str | None = None,
+    current_user: User = Depends(get_current_user),
+):
+    """流式導出所有 COMPLETED 會議，服務端游標分批讀取，內存佔用恆定"""
+    if format == "parquet":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise HTTPException(status_code=400, detail="Parquet export requires pyarrow")
+    media_type = "application/x-ndjson" if format == "ndjson" else "application/vnd.apache.parquet"
+    filename = f"meetings.{format}"
+    return StreamingResponse(
+        export.export_stream(format, start=start, end=end, region=region),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+@app.get("/api/analytics/overview")
+def analytics_overview(start: date | None = None, end: date | None = None, region: str | None = None, db: Session = Depends(get_db)):
+    """跨會議匯總：會議數、總時長、發言佔比、平均人數等 (只查統計表)"""
+    return analytics.overview(db, start=to_utc_datetime(start), end=to_utc_datetime(end), region=region)
+
+@app.get("/api/analytics/keywords")
+def analytics_keywords(start: date | None = None, end: date | None = None, region: str | None = None, limit: int = 50, db: Session = Depends(get_db)):
+    return analytics.top_keywords(db, start=to_utc_datetime(start), end=to_utc_datetime(end), region=region, limit=limit)
+
+@app.get("/api/analytics/meetings/{task_db_id}")
+def analytics_meeting(task_db_id: str, db: Session = Depends(get_db)):
+    stats = analytics.meeting_stats(db, task_db_id)
+    if stats is None:
+        raise HTTPException(status_code=404, detail="Stats not found")
+    return stats
+
+@app.get("/api/events/tasks")
+async def task_events(request: Request, current_user: User = Depends(get_current_user)):
+    """
+    SSE：推送任務狀態變化 (NONE -> PREPARING -> SUBMITTING -> ONGOING -> COMPLETED / FAILED / DEAD / ORPHANED)
+    前端用 EventSource 訂閱，無需再輪詢 /api/files
+    """
+    queue = events.bus.subscribe()
+
+    async def stream():
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                if await request.is_disconnected():
+                    break
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=SSE_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    # 心跳，防止代理 (Render) 斷開空閒連接
+                    yield ": ping\n\n"
+                    continue
+                yield f"id: {event['event_id']}\nevent: status\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+        finally:
+            events.bus.unsubscribe(queue)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.get("/api/cache/stats")
+async def get_cache_stats():
+    return detail_cache.stats()
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,68 @@
+import threading
+from collections import defaultdict, deque
+from datetime import datetime, timezone
+from typing import Optional
+
+# priority >= URGENT_PRIORITY 视为按需加急 (API 手动提升)
+URGENT_PRIORITY = 100
+
+
+def priority_class(priority: Optional[int]) -> str:
+    return "urgent" if (priority or 0) >= URGENT_PRIORITY else "normal"
+
+
+def fair_order(tasks: list[dict]) -> list[dict]:
+    """
+    提交顺序：先按优先级分层；同一层内按 (region, 请求人) 分组轮转，
+    组内保持传入顺序 (调用方已按录制日期倒序)，避免某个区域的历史回填独占提交配额
+    """
+    tiers = defaultdict(lambda: defaultdict(deque))
+    for task in tasks:
+        group = (task["region"], task.get("requested_by") or "")
+        tiers[task.get("priority") or 0][group].append(task)
+
+    ordered = []
+    for priority in sorted(tiers, reverse=True):
+        groups = list(tiers[priority].values())
+        while groups:
+            for group in groups:
+                ordered.append(group.popleft())
+            groups = [group for group in groups if group]
+    return ordered
+
+
+class SubmitMetrics:
+    """按优先级类别统计排队时长 (进入队列 -> 成功提交听悟)"""
+
+    def __init__(self, window: int = 500):
+        self._lock = threading.Lock()
+        self._window = window
+        self._samples = defaultdict(lambda: deque(maxlen=self._window))
+        self._counts = defaultdict(int)
+
+    def observe(self, priority: Optional[int], queued_at: Optional[datetime]):
+        if queued_at is None:
+            return
+        if queued_at.tzinfo is None:
+            queued_at = queued_at.replace(tzinfo=timezone.utc)
+        seconds = (datetime.now(timezone.utc) - queued_at).total_seconds()
+        cls = priority_class(priority)
+        with self._lock:
+            self._samples[cls].append(seconds)
+            self._counts[cls] += 1
+
+    def stats(self) -> dict:
+        result = {}
+        with self._lock:
+            for cls, samples in self._samples.items():
+                ordered = sorted(samples)
+                result[cls] = {
+                    "submitted": self._counts[cls],
+                    "p50_seconds": ordered[len(ordered) // 2],
+                    "p95_seconds": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+                    "max_seconds": ordered[-1],
+                }
+        return result
+
+
+submit_metrics = SubmitMetrics()
@@ -1,15 +1,15 @@
 import os
 
-from alibabacloud_tingwu20230930.client import Client as tingwu20230930Client
-from alibabacloud_credentials.client import Client as CredentialClient
-from alibabacloud_tea_openapi import models as open_api_models
-from alibabacloud_tingwu20230930 import models as tingwu_20230930_models
-from alibabacloud_tea_util import models as util_models
-from alibabacloud_tea_util.client import Client as UtilClient
-
 from dotenv import load_dotenv
 
 import aos
+from lazy import lazy_import
+
+tingwu20230930_client = lazy_import("alibabacloud_tingwu20230930.client")
+open_api_models = lazy_import("alibabacloud_tea_openapi.models")
+tingwu_20230930_models = lazy_import("alibabacloud_tingwu20230930.models")
+util_models = lazy_import("alibabacloud_tea_util.models")
+tea_exceptions = lazy_import("Tea.exceptions")
 
 class QueryResult:
     MeetingAssistance: str
@@ -30,11 +30,11 @@ class QueryResult:
 #     )
 #     # Endpoint 请参考 https://api.aliyun.com/product/tingwu
 #     config.endpoint = f'tingwu.cn-beijing.aliyuncs.com'
-#     return tingwu20230930Client(config)
+#     return tingwu20230930_client.Client(config)
 
 load_dotenv()
 
-def create_client() -> tingwu20230930Client:
+def create_client():
     """
     显式使用 AK/SK 初始化 Tingwu 客户端，避免在子线程中触发信号注册。
     """
@@ -52,12 +52,12 @@ def create_client() -> tingwu20230930Client:
         access_key_secret=sk,
         endpoint="tingwu.cn-beijing.aliyuncs.com"
     )
-    return tingwu20230930Client(config)
+    return tingwu20230930_client.Client(config)
 
 
-def submit_task(oss_client, task_key: str):
-    # 生成预签名的GET请求
-    cdn_url = aos.get_object_url(oss_client, task_key)
+def submit_task(oss_client, task_key: str, file_url: str = None, submit_key: str = None):
+    # 生成预签名的GET请求 (调用方已按 region 生成链接时直接使用)
+    cdn_url = file_url or aos.get_object_url(oss_client, task_key)
     print(f"internal_url: {cdn_url}")
 
     # stt client
@@ -82,7 +82,7 @@ def submit_task(oss_client, task_key: str):
     input = tingwu_20230930_models.CreateTaskRequestInput(
         source_language='fspk',
         file_url= cdn_url,
-        task_key= task_key
+        task_key= submit_key or task_key
     )
     create_task_request = tingwu_20230930_models.CreateTaskRequest(
         type='offline',
@@ -94,17 +94,23 @@ def submit_task(oss_client, task_key: str):
     headers = {}
     try:
         res = client.create_task_with_options(create_task_request, headers, runtime)
-        if res.body.message != "success":
-            return {"task_id": "", "status": res.body.data.task_status}
-
-        return {"task_id": res.body.data.task_id, "status": res.body.data.task_status}
     except Exception as error:
-        # 此处仅做打印展示，请谨慎对待异常处理，在工程项目中切勿直接忽略异常。
-        # 错误 message
         print(f"error: {error}")
-        # 诊断地址
-        # print(error.data.get("Recommend"))
-        # UtilClient.assert_as_string(error.message)
+        # 把错误带回给调用方记录 last_error，而不是返回 None
+        # 只有听悟明确返回 4xx 才能确定任务没被受理；超时/断线/5xx 时可能已受理，标记 ambiguous
+        status_code = getattr(error, "statusCode", None)
+        rejected = (
+            isinstance(error, tea_exceptions.TeaException)
+            and not isinstance(error, tea_exceptions.UnretryableException)
+            and status_code is not None and status_code < 500
+        )
+        return {"task_id": "", "status": "ERROR", "error": str(error), "ambiguous": not rejected}
+
+    if res.body.message != "success":
+        data = res.body.data
+        return {"task_id": "", "status": data.task_status if data else "ERROR", "error": res.body.message}
+
+    return {"task_id": res.body.data.task_id, "status": res.body.data.task_status}
 
 def query_task(task_id: str):
     client = create_client()
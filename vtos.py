@@ -0,0 +1,121 @@
+import os
+
+from dotenv import load_dotenv
+
+from lazy import lazy_import
+
+tos = lazy_import("tos")
+
+load_dotenv()
+
+VIDEO_PREFIX = 'downloaded_videos/'
+
+
+def region_from_endpoint(endpoint: str) -> str:
+    """
+    tos-cn-guangzhou.volces.com -> cn-guangzhou
+    """
+    host = endpoint.split('.')[0]
+    return host[len('tos-'):] if host.startswith('tos-') else host
+
+
+def init_client(endpoint: str, region: str = None):
+    """
+    火山引擎 TOS 同步客户端，凭证从环境变量读取
+    """
+    ak = os.getenv("TOS_ACCESS_KEY")
+    sk = os.getenv("TOS_SECRET_KEY")
+
+    if not ak or not sk:
+        raise ValueError(
+            "Missing TOS_ACCESS_KEY or TOS_SECRET_KEY. "
+            "Please set them in environment variables."
+        )
+
+    return tos.TosClientV2(ak, sk, endpoint, region or region_from_endpoint(endpoint))
+
+
+def get_all_files(client, bucket, prefix=VIDEO_PREFIX):
+    """
+    list all objects under prefix (同步，需放入线程池)
+    """
+    contents = []
+    continuation_token = None
+    while True:
+        result = client.list_objects_type2(bucket, prefix=prefix, continuation_token=continuation_token, max_keys=1000)
+        contents.extend(result.contents or [])
+        if not result.is_truncated:
+            break
+        continuation_token = result.next_continuation_token
+    return contents
+
+
+def get_object_url(client, object_key, bucket, expires=3600) -> str:
+    """
+    Get object's presigned download url.
+    """
+    try:
+        pre_result = client.pre_signed_url(
+            tos.HttpMethodType.Http_Method_Get,
+            bucket=bucket,
+            key=VIDEO_PREFIX+object_key,
+            expires=expires,
+        )
+        return pre_result.signed_url
+
+    except Exception as e:
+        print("Error while getting the url: ", e)
+        return 'Invalid url'
+
+
+def head_object(client, object_key, bucket):
+    """
+    return (size, content_type, etag)
+    """
+    result = client.head_object(bucket, VIDEO_PREFIX+object_key)
+    return result.content_length, result.content_type, result.etag
+
+
+def get_object_hash(client, object_key, bucket):
+    """
+    返回 TOS 计算的 CRC64-ECMA，与 OSS 的 hash_crc64 同一算法，可跨云比对
+    """
+    result = client.head_object(bucket, VIDEO_PREFIX+object_key)
+    return f"crc64:{result.hash_crc64_ecma}" if result.hash_crc64_ecma else None
+
+
+def put_object_file(client, object_key, file_path, bucket, content_type=None):
+    """
+    上传本地文件到 downloaded_videos/ 下，返回 ETag
+    """
+    result = client.put_object_from_file(bucket, VIDEO_PREFIX+object_key, file_path, content_type=content_type)
+    return result.etag
+
+
+def iter_object(client, object_key, start, end, bucket, chunk_size=256 * 1024):
+    """
+    按 Range 读取 [start, end] 字节，每次只产出 chunk_size 大小，整个对象不会进内存
+    """
+    result = client.get_object(bucket, VIDEO_PREFIX+object_key, range_start=start, range_end=end)
+    try:
+        while True:
+            chunk = result.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        # 客户端拖动进度条会中断下载，及时释放连接，不等 GC
+        _close_body(result)
+
+
+def _close_body(result):
+    """
+    GetObjectOutput.content 可能被 CRC / 进度回调包装 (.data)，
+    解开到 tos.http.Response 后关闭底层的 requests 响应
+    """
+    body = result.content
+    while not hasattr(body, "resp") and hasattr(body, "data"):
+        body = body.data
+    response = getattr(body, "resp", None)
+    if response is not None:
+        response.close()